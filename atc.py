@@ -1,21 +1,32 @@
+import argparse
+import contextlib
+import csv
 import dataclasses
 import enum
+import heapq
+import json
+import os
 import random
 import time
 import queue
+import multiprocessing as mp
+from bisect import bisect_left, insort
 from collections import deque
+from multiprocessing import shared_memory
 from threading import Thread
-from math import pi as PI, cos, sin, dist, atan2
-from typing import Any, Deque, Dict, List, Optional, Tuple
+from math import pi as PI, cos, sin, dist, floor, ceil, atan2, hypot, isqrt, sqrt
+from itertools import combinations, groupby
+from typing import Any, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
 
 # Set `True` to visualize simulation real-time using `matplotlib`
 DRAW_SIM = True
-if DRAW_SIM:
-    import matplotlib.pyplot as plt
 
 
 Uid = int
 Loc = Tuple[float, float]
+Cell = Tuple[int, int]
 
 
 @dataclasses.dataclass(frozen=True)
@@ -43,6 +54,232 @@ class ControlZone:
         Runway((-250-50, -250), PI/2, 500),
         Runway((250+50, -250), PI/2, 500),
     ]
+    # Close in so held aircraft reach the runways quickly. Adjacent fixes are
+    # about 1150 m apart, leaving at least 3 * MIN_AIRCRAFT_SEP between orbits
+    HOLD_RADIUS = 400  # [m]
+    HOLD_FIXES = [(1_500 * cos(2*PI * k/8), 1_500 * sin(2*PI * k/8)) for k in range(8)]
+    HOLD_LEVELS = 32  # Holding altitudes stacked above each fix
+    HOLD_BASE_ALT = 1_500  # [m]
+    HOLD_LEVEL_SEP = 300  # [m]
+    _runway_db: Optional["RunwayDB"] = None
+
+    @classmethod
+    def runway_db(cls) -> "RunwayDB":
+        """Returns spatial index over `RUNWAYS`, rebuilding it if they have changed."""
+        db = cls._runway_db
+        if db is None or db.runways is not cls.RUNWAYS or len(db) != len(cls.RUNWAYS):
+            db = cls._runway_db = RunwayDB(cls.RUNWAYS)
+        return db
+
+    @classmethod
+    def load_runways(cls, path: str):
+        """Replaces `RUNWAYS` with those from a runway database file, see `RunwayDB.load`."""
+        db = RunwayDB.load(path)
+        cls.RUNWAYS = db.runways
+        cls._runway_db = db
+
+
+class SpatialGrid:
+    """Uniform grid bucketing positions by cell for fast proximity queries."""
+
+    # Half of the 8-neighbourhood, so each pair of adjacent cells is visited once
+    _FORWARD_NEIGHBOURS = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.locs: Dict[Uid, Loc] = {}
+        self._cells: Dict[Cell, Set[Uid]] = {}
+        self._where: Dict[Uid, Cell] = {}
+        self._bounds: Optional[Tuple[int, int, int, int]] = None  # Of all cells ever used
+
+    def __len__(self) -> int:
+        return len(self.locs)
+
+    def cell_of(self, loc: Loc) -> Cell:
+        """Returns grid cell containing a position."""
+        return (floor(loc[0] / self.cell_size), floor(loc[1] / self.cell_size))
+
+    def update(self, uid: Uid, loc: Loc):
+        """Inserts or moves an entry, only touching buckets on a cell change."""
+        cell = self.cell_of(loc)
+        old = self._where.get(uid)
+        if old != cell:
+            if old is not None:
+                self._discard(uid, old)
+            self._cells.setdefault(cell, set()).add(uid)
+            self._where[uid] = cell
+            if self._bounds is None:
+                self._bounds = (cell[0], cell[1], cell[0], cell[1])
+            else:
+                x0, y0, x1, y1 = self._bounds
+                self._bounds = (min(x0, cell[0]), min(y0, cell[1]), max(x1, cell[0]), max(y1, cell[1]))
+        self.locs[uid] = loc
+
+    def remove(self, uid: Uid):
+        """Stops tracking an entry."""
+        self._discard(uid, self._where.pop(uid))
+        self.locs.pop(uid)
+
+    def close_pairs(self, radius: float) -> Iterator[Tuple[Uid, Uid]]:
+        """Yields each unordered pair within `radius`, which must fit in a cell."""
+        assert radius <= self.cell_size
+        locs = self.locs
+        for (cx, cy), uids in self._cells.items():
+            members = [(uid, locs[uid]) for uid in uids]
+            for i, (uid, loc) in enumerate(members):
+                for other, other_loc in members[i + 1:]:
+                    if dist(loc, other_loc) <= radius:
+                        yield uid, other
+            for dx, dy in self._FORWARD_NEIGHBOURS:
+                neighbours = self._cells.get((cx + dx, cy + dy))
+                if not neighbours:
+                    continue
+                for uid, loc in members:
+                    for other in neighbours:
+                        if dist(loc, locs[other]) <= radius:
+                            yield uid, other
+
+    def k_nearest(
+        self, loc: Loc, k: int, accept: Optional[Callable[[Uid], bool]] = None,
+    ) -> List[Tuple[float, Uid]]:
+        """Returns up to `k` (distance, uid) of the nearest entries passing `accept`, closest first.
+
+        Searches rings of cells outwards from `loc`, stopping once no unsearched
+        cell could hold anything closer. If a ring would have more cells than
+        are occupied, the remaining occupied cells are scanned directly instead.
+        """
+        if not self._cells or k <= 0:
+            return []
+        cx, cy = self.cell_of(loc)
+        x0, y0, x1, y1 = self._bounds
+        extent = max(cx - x0, x1 - cx, cy - y0, y1 - cy)
+        best: List[Tuple[float, Uid]] = []  # Max-heap of negated distances
+
+        def visit(uids):
+            for uid in uids:
+                if accept is not None and not accept(uid):
+                    continue
+                d = dist(loc, self.locs[uid])
+                if len(best) < k:
+                    heapq.heappush(best, (-d, uid))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, uid))
+
+        for r in range(extent + 1):
+            if 8 * r > len(self._cells):
+                for (x, y), uids in self._cells.items():
+                    if max(abs(x - cx), abs(y - cy)) >= r:
+                        visit(uids)
+                break
+            if r == 0:
+                ring = [(cx, cy)]
+            else:
+                ring = [(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)]
+                ring += [(cx + dx, cy + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+            for cell in ring:
+                visit(self._cells.get(cell, ()))
+            # Anything in rings further out is at least `r` cells away
+            if len(best) == k and -best[0][0] <= r * self.cell_size:
+                break
+        return sorted((-d, uid) for d, uid in best)
+
+    def _discard(self, uid: Uid, cell: Cell):
+        bucket = self._cells[cell]
+        bucket.discard(uid)
+        if not bucket:
+            del self._cells[cell]
+
+
+class RunwayDB:
+    """Runways of any number of airports, indexed for nearest-runway queries.
+
+    Runway indices refer to positions in `runways`. Queries can be limited to
+    runways at least `min_length` long, and within `heading_tol` of `heading`.
+    """
+
+    def __init__(self, runways: List[Runway], airports: Optional[List[str]] = None, cell_size: float = 10_000):
+        self.runways = runways
+        self.airports = airports if airports is not None else ["" for _ in runways]
+        self._grid = SpatialGrid(cell_size)
+        for i, runway in enumerate(runways):
+            self._grid.update(i, runway.pos)
+
+    def __len__(self) -> int:
+        return len(self.runways)
+
+    @classmethod
+    def load(cls, path: str, cell_size: float = 10_000) -> "RunwayDB":
+        """Loads runways from a `.csv` file or `.json` list of objects.
+
+        Each record has `airport`, `x` and `y` [m], `heading` [rad] and `length` [m].
+        """
+        with open(path, newline="") as f:
+            if path.endswith(".json"):
+                records = json.load(f)
+            else:
+                records = list(csv.DictReader(f))
+        runways = [
+            Runway((float(r["x"]), float(r["y"])), float(r["heading"]), float(r["length"]))
+            for r in records
+        ]
+        return cls(runways, [r.get("airport", "") for r in records], cell_size)
+
+    def nearest(
+        self, loc: Loc, min_length: float = 0.0, heading: Optional[float] = None, heading_tol: float = PI,
+    ) -> Optional[int]:
+        """Returns index of the closest matching runway, or `None` if none match."""
+        found = self.k_nearest(loc, 1, min_length, heading, heading_tol)
+        return found[0] if found else None
+
+    def k_nearest(
+        self, loc: Loc, k: int, min_length: float = 0.0, heading: Optional[float] = None,
+        heading_tol: float = PI,
+    ) -> List[int]:
+        """Returns indices of up to `k` closest matching runways, closest first."""
+        def accept(i: Uid) -> bool:
+            runway = self.runways[i]
+            if runway.length < min_length:
+                return False
+            return heading is None or abs((runway.heading - heading + PI) % (2*PI) - PI) <= heading_tol
+
+        filtered = min_length > 0 or heading is not None
+        return [i for _, i in self._grid.k_nearest(loc, k, accept if filtered else None)]
+
+
+def swept_box_pairs(
+    x: np.ndarray, y: np.ndarray, vx: np.ndarray, vy: np.ndarray,
+    horizon: float, margin: float, chunk: int = 1 << 21,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yields index arrays (i, j) of pairs whose swept paths may come within `margin`.
+
+    Each path over `horizon` seconds is bounded by a box padded by half of
+    `margin`, and overlapping boxes are found by sort-and-sweep along x. Pairs
+    are yielded in chunks of about `chunk` to bound memory use.
+    """
+    n = len(x)
+    pad = margin / 2
+    x1, y1 = x + horizon * vx, y + horizon * vy
+    lo_x, hi_x = np.minimum(x, x1) - pad, np.maximum(x, x1) + pad
+    lo_y, hi_y = np.minimum(y, y1) - pad, np.maximum(y, y1) + pad
+
+    order = np.argsort(lo_x, kind="stable")
+    lo_x, hi_x, lo_y, hi_y = lo_x[order], hi_x[order], lo_y[order], hi_y[order]
+    # Sorted by lower x bound, so each box's x-overlaps are the ones right after it
+    end = np.searchsorted(lo_x, hi_x, side="right")
+    counts = np.maximum(end - np.arange(n) - 1, 0)
+    totals = np.cumsum(counts)
+
+    start = 0
+    while start < n:
+        base = totals[start - 1] if start else 0
+        stop = max(int(np.searchsorted(totals, base + chunk, side="right")), start + 1)
+        c = counts[start:stop]
+        i = np.repeat(np.arange(start, stop), c)
+        first = np.cumsum(c) - c
+        j = i + 1 + np.arange(len(i)) - np.repeat(first, c)
+        overlap = (lo_y[j] <= hi_y[i]) & (lo_y[i] <= hi_y[j])
+        yield order[i[overlap]], order[j[overlap]]
+        start = stop
 
 
 @enum.unique
@@ -63,225 +300,1830 @@ class Aircraft:
     speed: float = 140  # [m / s]
     state: AircraftState = AircraftState.FLIGHT
     runway: Optional[Runway] = None
+    transit: bool = False  # Only passing through, so not to be landed or held
 
 
 @enum.unique
 class PlaneCommand(enum.Enum):
     """Commands that the ATC can send to a specific aircraft."""
     HEADING = enum.auto()
-    HOLDING = enum.auto()
+    HOLDING = enum.auto()  # Data is (center x, center y, radius, altitude) of orbit
     LAND = enum.auto()
 
+
+class Command(NamedTuple):
+    """A command sent from the ATC to a specific aircraft."""
+
+    uid: Uid
+    command: PlaneCommand
+    data: Any
+    sent: float  # `time.perf_counter()` when sent [s]
+
+
+@dataclasses.dataclass
+class LocFrame:
+    """One tick of aircraft location changes sent from `Sim` to the ATC.
+
+    Keyframes list every aircraft across `spawned` and `moved`, so any tracked
+    aircraft missing from one has been removed. This lets a consumer that fell
+    behind drop everything before the latest keyframe and resync from it.
+    """
+
+    seq: int
+    t: float  # Simulated time of the tick [s]
+    keyframe: bool
+    spawned: List[Tuple[Uid, Loc]]
+    moved: List[Tuple[Uid, Loc]]
+    removed: List[Uid]
+    sent: float = 0.0  # `time.perf_counter()` when sent [s]
+    # Uids of aircraft only passing through, out of those spawned, or of all listed on keyframes
+    transit: List[Uid] = dataclasses.field(default_factory=list)
+
+    def present(self) -> Set[Uid]:
+        """Returns uids of all aircraft listed in the frame."""
+        return {uid for uid, _ in self.spawned} | {uid for uid, _ in self.moved}
+
+
 class Comms:
-    """Emulates communication between ATC and actual aircraft."""
+    """Emulates communication between ATC and actual aircraft.
 
-    def __init__(self):
+    Locations are delta-encoded against the last ones sent: an aircraft only
+    counts as moved once it has drifted at least `move_threshold` metres, and
+    every `keyframe_every`-th frame resends everything.
+    """
+
+    def __init__(self, move_threshold: float = ControlZone.MIN_AIRCRAFT_SEP / 4, keyframe_every: int = 50):
+        self.move_threshold = move_threshold
+        self.keyframe_every = keyframe_every
         # Use queue message passing for inter-thread communication
         self.sim_to_atc = queue.SimpleQueue()
         self.atc_to_sim = queue.SimpleQueue()
+        self.dropped_commands = 0  # Unbounded, so never any
+        self.dropped_locations = 0
+        # Last locations sent, sorted by uid
+        self._seq = 0
+        self._sent_uids = np.empty(0, dtype=np.int64)
+        self._sent_x = np.empty(0)
+        self._sent_y = np.empty(0)
+
+    def update_plane_locs(
+        self, uids: np.ndarray, xs: np.ndarray, ys: np.ndarray, t: float = 0.0, transit: Optional[np.ndarray] = None,
+    ):
+        """Encodes and sends the current location of every aircraft as a `LocFrame`.
+
+        `transit` optionally flags aircraft only passing through.
+        """
+        seq, self._seq = self._seq, self._seq + 1
+        keyframe = seq % self.keyframe_every == 0
+        prev = self._sent_uids
+
+        known = np.isin(uids, prev, assume_unique=True)
+        removed = prev[~np.isin(prev, uids, assume_unique=True)]
+        spawned = np.flatnonzero(~known)
+        known = np.flatnonzero(known)
+        j = np.searchsorted(prev, uids[known])
+        if keyframe:
+            moved = known
+        else:
+            drift = np.hypot(xs[known] - self._sent_x[j], ys[known] - self._sent_y[j])
+            is_moved = drift >= self.move_threshold
+            moved = known[is_moved]
+            # Anything that hasn't moved enough keeps its previously sent location
+            xs, ys = xs.copy(), ys.copy()
+            xs[known[~is_moved]] = self._sent_x[j[~is_moved]]
+            ys[known[~is_moved]] = self._sent_y[j[~is_moved]]
+
+        order = np.argsort(uids, kind="stable")
+        self._sent_uids = uids[order]
+        self._sent_x = xs[order]
+        self._sent_y = ys[order]
+
+        def pairs(idx):
+            return list(zip(uids[idx].tolist(), zip(xs[idx].tolist(), ys[idx].tolist())))
 
-    def update_plane_locs(self, plane_locs: List[Tuple[Uid, Loc]]):
-        self.sim_to_atc.put(plane_locs)
+        flagged = []
+        if transit is not None:
+            listed = np.arange(len(uids)) if keyframe else spawned
+            flagged = uids[listed[transit[listed]]].tolist()
+        self.sim_to_atc.put(LocFrame(
+            seq, t, keyframe, pairs(spawned), pairs(moved), removed.tolist(), time.perf_counter(), flagged,
+        ))
 
-    def get_plane_locs(self) -> List[Tuple[Uid, Loc]]:
-        last = self.sim_to_atc.get()
-        # Flush recieve queue to get latest update
+    def get_plane_updates(self) -> List[LocFrame]:
+        """Waits for and returns all pending frames, skipping any before the latest keyframe."""
+        frames = [self.sim_to_atc.get()]
         while True:
             try:
-                last = self.sim_to_atc.get_nowait()
+                frames.append(self.sim_to_atc.get_nowait())
             except queue.Empty:
-                return last
+                break
+        for i in range(len(frames) - 1, 0, -1):
+            if frames[i].keyframe:
+                return frames[i:]
+        return frames
+
+    def frame_backlog(self) -> int:
+        """Returns number of location frames sent but not yet received."""
+        return self.sim_to_atc.qsize()
 
     def send_command(self, uid: Uid, command: PlaneCommand, data: Any = None):
-        self.atc_to_sim.put((uid, command, data))
+        self.atc_to_sim.put(Command(uid, command, data, time.perf_counter()))
 
-    def check_for_command(self) -> Optional[Tuple[Uid, PlaneCommand, Any]]:
+    def check_for_command(self) -> Optional[Command]:
         try:
             return self.atc_to_sim.get_nowait()
         except queue.Empty:
             return None
 
+    def drain_commands(self) -> List[Command]:
+        """Returns all pending commands in the order sent."""
+        cmds = []
+        while True:
+            try:
+                cmds.append(self.atc_to_sim.get_nowait())
+            except queue.Empty:
+                return cmds
+
+    def command_backlog(self) -> int:
+        """Returns number of commands sent but not yet received."""
+        return self.atc_to_sim.qsize()
+
+
+class SharedMemComms:
+    """`Comms` backed by `multiprocessing.shared_memory`, for running parts in separate processes.
+
+    One shared block holds a fixed layout of:
+      * a ring of `slots` position frames, each a full snapshot of up to
+        `max_planes` aircraft, written by a single `Sim`, and
+      * a single-producer single-consumer ring of `cmd_capacity` commands.
+    Sending to a full command ring waits up to `send_timeout` seconds for the
+    consumer, then drops the command and counts it in `dropped_commands`.
+    Aircraft beyond `max_planes` are left out of frames and counted in the
+    shared `dropped_locations`. Frames are read seqlock-style, retrying up to
+    `READ_RETRIES` times if the writer lapped the reader mid-copy, so any
+    number of processes can read them. Instances pickle by
+    name, so passing one to a child process attaches it to the same block.
+    """
+
+    # Header slots
+    _FRAME_HEAD, _CMD_WRITE, _CMD_READ, _DROPPED_LOCS = range(4)
+    # Command data type codes
+    _DATA_NONE, _DATA_INT, _DATA_FLOAT, _DATA_TUPLE = range(4)
+    CMD_DATA_LEN = 4
+    READ_RETRIES = 1000
+
+    def __init__(
+        self, max_planes: int = 4096, slots: int = 8, cmd_capacity: int = 1024, name: Optional[str] = None,
+        send_timeout: float = 1.0,
+    ):
+        self.max_planes = max_planes
+        self.slots = slots
+        self.cmd_capacity = cmd_capacity
+        self.send_timeout = send_timeout  # [s]
+        self.dropped_commands = 0
+        self._owner = name is None
+        self._attach(name)
+
+    def __getstate__(self):
+        return (self.shm.name, self.max_planes, self.slots, self.cmd_capacity, self.send_timeout)
+
+    def __setstate__(self, state):
+        name, self.max_planes, self.slots, self.cmd_capacity, self.send_timeout = state
+        self.dropped_commands = 0
+        self._owner = False
+        self._attach(name)
+
+    def _layout(self) -> List[Tuple[str, Any, Tuple[int, ...]]]:
+        k, m, c = self.slots, self.max_planes, self.cmd_capacity
+        return [
+            ("header", np.int64, (4,)),
+            ("slot_seq", np.int64, (k,)),
+            ("slot_n", np.int64, (k,)),
+            ("slot_t", np.float64, (k,)),
+            ("slot_sent", np.float64, (k,)),
+            ("slot_uid", np.int64, (k, m)),
+            ("slot_x", np.float64, (k, m)),
+            ("slot_y", np.float64, (k, m)),
+            ("cmd_uid", np.int64, (c,)),
+            ("cmd_kind", np.int64, (c,)),
+            ("cmd_dtype", np.int64, (c,)),
+            ("cmd_len", np.int64, (c,)),
+            ("cmd_data", np.float64, (c, self.CMD_DATA_LEN)),
+            ("cmd_sent", np.float64, (c,)),
+            ("slot_transit", np.bool_, (k, m)),
+        ]
+
+    def _attach(self, name: Optional[str]):
+        layout = self._layout()
+        size = sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in layout)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator should unlink the block, but attaching registers it with the resource tracker too
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        offset = 0
+        for field, dtype, shape in layout:
+            arr = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, "_" + field, arr)
+            offset += arr.nbytes
+        if name is None:
+            self._header[:] = 0
+            self._slot_seq[:] = -1
+        self._last_seq = 0
+
+    def close(self):
+        """Detaches from the shared block, unlinking it if this instance created it."""
+        for field, _, _ in self._layout():
+            setattr(self, "_" + field, None)
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+    def update_plane_locs(
+        self, uids: np.ndarray, xs: np.ndarray, ys: np.ndarray, t: float = 0.0, transit: Optional[np.ndarray] = None,
+    ):
+        """Publishes a snapshot of aircraft locations into the next ring slot, truncated to `max_planes`."""
+        n = len(uids)
+        if n > self.max_planes:
+            self._header[self._DROPPED_LOCS] += n - self.max_planes
+            n = self.max_planes
+        seq = int(self._header[self._FRAME_HEAD]) + 1
+        slot = seq % self.slots
+        self._slot_seq[slot] = -1  # Mark as being written
+        self._slot_n[slot] = n
+        self._slot_t[slot] = t
+        self._slot_uid[slot, :n] = uids[:n]
+        self._slot_x[slot, :n] = xs[:n]
+        self._slot_y[slot, :n] = ys[:n]
+        self._slot_transit[slot, :n] = False if transit is None else transit[:n]
+        self._slot_sent[slot] = time.perf_counter()
+        self._slot_seq[slot] = seq
+        self._header[self._FRAME_HEAD] = seq
+
+    @property
+    def dropped_locations(self) -> int:
+        """Aircraft locations left out of frames for lack of room, summed over frames."""
+        return int(self._header[self._DROPPED_LOCS])
+
+    def snapshot(self) -> Optional[Tuple[int, float, np.ndarray, np.ndarray, np.ndarray]]:
+        """Returns copy of the latest frame as (seq, t, uids, xs, ys), or `None` if none yet."""
+        snap = self._read_latest()
+        return snap[:5] if snap else None
+
+    def _read_latest(self) -> Optional[Tuple[int, float, np.ndarray, np.ndarray, np.ndarray, float, np.ndarray]]:
+        for _ in range(self.READ_RETRIES):
+            seq = int(self._header[self._FRAME_HEAD])
+            if seq == 0:
+                return None
+            slot = seq % self.slots
+            n = int(self._slot_n[slot])
+            t = float(self._slot_t[slot])
+            uids = self._slot_uid[slot, :n].copy()
+            xs = self._slot_x[slot, :n].copy()
+            ys = self._slot_y[slot, :n].copy()
+            transit = self._slot_transit[slot, :n].copy()
+            sent = float(self._slot_sent[slot])
+            if self._slot_seq[slot] == seq:
+                return seq, t, uids, xs, ys, sent, transit
+        raise RuntimeError(f"No consistent frame after {self.READ_RETRIES} reads, writer may have died mid-write")
+
+    def get_plane_updates(self, poll: float = 1e-4) -> List[LocFrame]:
+        """Waits for a newer frame than last read and returns it as a keyframe."""
+        while int(self._header[self._FRAME_HEAD]) == self._last_seq:
+            time.sleep(poll)
+        seq, t, uids, xs, ys, sent, transit = self._read_latest()
+        self._last_seq = seq
+        locs = list(zip(uids.tolist(), zip(xs.tolist(), ys.tolist())))
+        return [LocFrame(seq, t, True, [], locs, [], sent, uids[transit].tolist())]
+
+    def frame_backlog(self) -> int:
+        """Returns number of location frames published since the last one read."""
+        return int(self._header[self._FRAME_HEAD]) - self._last_seq
+
+    def send_command(self, uid: Uid, command: PlaneCommand, data: Any = None):
+        write = int(self._header[self._CMD_WRITE])
+        if write - int(self._header[self._CMD_READ]) >= self.cmd_capacity:
+            deadline = time.perf_counter() + self.send_timeout
+            while write - int(self._header[self._CMD_READ]) >= self.cmd_capacity:
+                if time.perf_counter() >= deadline:
+                    self.dropped_commands += 1
+                    return
+                time.sleep(1e-4)
+        i = write % self.cmd_capacity
+        self._cmd_uid[i] = uid
+        self._cmd_kind[i] = command.value
+        if data is None:
+            self._cmd_dtype[i], self._cmd_len[i] = self._DATA_NONE, 0
+        elif isinstance(data, (int, np.integer)):
+            self._cmd_dtype[i], self._cmd_len[i] = self._DATA_INT, 1
+            self._cmd_data[i, 0] = data
+        elif isinstance(data, (float, np.floating)):
+            self._cmd_dtype[i], self._cmd_len[i] = self._DATA_FLOAT, 1
+            self._cmd_data[i, 0] = data
+        else:
+            if len(data) > self.CMD_DATA_LEN:
+                raise ValueError(f"Command data longer than {self.CMD_DATA_LEN} values")
+            self._cmd_dtype[i], self._cmd_len[i] = self._DATA_TUPLE, len(data)
+            self._cmd_data[i, :len(data)] = data
+        self._cmd_sent[i] = time.perf_counter()
+        self._header[self._CMD_WRITE] = write + 1
+
+    def check_for_command(self) -> Optional[Command]:
+        read = int(self._header[self._CMD_READ])
+        if read == int(self._header[self._CMD_WRITE]):
+            return None
+        i = read % self.cmd_capacity
+        dtype = self._cmd_dtype[i]
+        if dtype == self._DATA_NONE:
+            data = None
+        elif dtype == self._DATA_INT:
+            data = int(self._cmd_data[i, 0])
+        elif dtype == self._DATA_FLOAT:
+            data = float(self._cmd_data[i, 0])
+        else:
+            data = tuple(self._cmd_data[i, :self._cmd_len[i]].tolist())
+        cmd = Command(int(self._cmd_uid[i]), PlaneCommand(int(self._cmd_kind[i])), data, float(self._cmd_sent[i]))
+        self._header[self._CMD_READ] = read + 1
+        return cmd
+
+    def drain_commands(self) -> List[Command]:
+        """Returns all pending commands in the order sent."""
+        cmds = []
+        cmd = self.check_for_command()
+        while cmd is not None:
+            cmds.append(cmd)
+            cmd = self.check_for_command()
+        return cmds
+
+    def command_backlog(self) -> int:
+        """Returns number of commands sent but not yet received."""
+        return int(self._header[self._CMD_WRITE] - self._header[self._CMD_READ])
+
+
+@dataclasses.dataclass(frozen=True)
+class Conflict:
+    """Predicted loss of separation between two aircraft."""
+
+    uid: Uid
+    other: Uid
+    t_cpa: float  # Time until closest point of approach [s]
+    d_cpa: float  # Separation at closest point of approach [m]
+
+
+class FifoScheduler:
+    """Lands aircraft on their closest runway in order of first contact."""
+
+    def __init__(self, runway_db: RunwayDB):
+        self.runway_db = runway_db
+        self.runways = runway_db.runways
+        self._qs: List[Deque[Uid]] = [deque() for _ in self.runways]
+        self._waiting: Set[int] = set()
+
+    def waiting_runways(self) -> List[int]:
+        """Returns indices of runways with aircraft queued for them."""
+        return sorted(self._waiting)
+
+    def add(self, plane: Aircraft, now: float) -> int:
+        """Queues a new aircraft, returning index of the runway it's assigned to."""
+        closest = self.runway_db.nearest(plane.loc)
+        self._qs[closest].append(plane.uid)
+        self._waiting.add(closest)
+        return closest
+
+    def update(self, plane: Aircraft, now: float) -> Optional[int]:
+        """Re-sequences an aircraft after it moves, returning its runway if still queued."""
+        return None
+
+    def queues(self) -> Dict[int, List[Uid]]:
+        """Returns the aircraft queued for each waiting runway, next to land first."""
+        return {runway_idx: list(self._qs[runway_idx]) for runway_idx in self._waiting}
+
+    def remove(self, uid: Uid):
+        """Drops an aircraft from sequencing."""
+        for runway_idx in self._waiting:
+            q = self._qs[runway_idx]
+            if uid in q:
+                q.remove(uid)
+                if not q:
+                    self._waiting.discard(runway_idx)
+                return
+
+    def release(self, runway_idx: int, now: float) -> Optional[Uid]:
+        """Returns the next aircraft cleared to land on a now free runway, if any."""
+        q = self._qs[runway_idx]
+        if not q:
+            return None
+        uid = q.popleft()
+        if not q:
+            self._waiting.discard(runway_idx)
+        return uid
+
+
+class EtaScheduler:
+    """Sequences aircraft by estimated time of arrival, balancing load across runways.
+
+    Each runway keeps a list of its aircraft sorted by ETA. Aircraft are
+    assigned to whichever runway they could land on soonest, counting
+    `slot_time` seconds for each aircraft already queued there. They are
+    re-sequenced as they move by re-inserting their entry, which only shifts
+    it a little as ETAs of aircraft flying in rarely reorder.
+    """
+
+    def __init__(self, runway_db: RunwayDB, slot_time: float = 20.0, candidates: int = 4):
+        self.runway_db = runway_db
+        self.runways = runway_db.runways
+        self.slot_time = slot_time  # Expected runway occupancy per landing [s]
+        self.candidates = candidates  # Nearest runways considered per aircraft
+        self._queues: Dict[int, List[Tuple[float, Uid]]] = {}  # (ETA, uid) per runway with any, soonest first
+        self._entry: Dict[Uid, Tuple[int, Tuple[float, Uid]]] = {}  # Runway and queue entry of each aircraft
+
+    def eta(self, plane: Aircraft, runway_idx: int) -> float:
+        """Estimated time for an aircraft to fly to and roll out on a runway [s]."""
+        runway = self.runways[runway_idx]
+        return (dist(plane.loc, runway.pos) + runway.length) / max(plane.speed, 1.0)
+
+    def waiting_runways(self) -> List[int]:
+        """Returns indices of runways with aircraft queued for them."""
+        return sorted(self._queues)
+
+    def add(self, plane: Aircraft, now: float) -> int:
+        """Queues a new aircraft, returning index of the runway it's assigned to."""
+        runway_idx = self._best_runway(plane, None)
+        self._assign(plane, runway_idx, now)
+        return runway_idx
+
+    def update(self, plane: Aircraft, now: float) -> Optional[int]:
+        """Re-sequences an aircraft after it moves, returning its runway if still queued."""
+        entry = self._entry.get(plane.uid)
+        if entry is None:
+            return None
+        runway_idx = self._best_runway(plane, entry[0])
+        self._assign(plane, runway_idx, now)
+        return runway_idx
+
+    def queues(self) -> Dict[int, List[Uid]]:
+        """Returns the aircraft queued for each waiting runway, next to land first."""
+        return {runway_idx: [uid for _, uid in q] for runway_idx, q in self._queues.items()}
+
+    def remove(self, uid: Uid):
+        """Drops an aircraft from sequencing."""
+        entry = self._entry.pop(uid, None)
+        if entry is not None:
+            self._unqueue(*entry)
+
+    def release(self, runway_idx: int, now: float) -> Optional[Uid]:
+        """Returns the next aircraft cleared to land on a now free runway, if any."""
+        q = self._queues.get(runway_idx)
+        if not q:
+            return None
+        uid = q[0][1]
+        self.remove(uid)
+        return uid
+
+    def _best_runway(self, plane: Aircraft, current: Optional[int]) -> int:
+        if len(self.runways) <= self.candidates:
+            options = range(len(self.runways))
+        else:
+            options = self.runway_db.k_nearest(plane.loc, self.candidates)
+            if current is not None and current not in options:
+                options.append(current)
+        best_i, best_cost = -1, float("inf")
+        for i in options:
+            # Don't count the aircraft itself against its current runway
+            queued = len(self._queues.get(i, ())) - (i == current)
+            cost = max(self.eta(plane, i), queued * self.slot_time)
+            if current is not None and i != current:
+                # Only switch runways for a clear gain, to avoid flip-flopping
+                cost += self.slot_time
+            if cost < best_cost:
+                best_i, best_cost = i, cost
+        return best_i
+
+    def _assign(self, plane: Aircraft, runway_idx: int, now: float):
+        self.remove(plane.uid)
+        key = (now + self.eta(plane, runway_idx), plane.uid)
+        insort(self._queues.setdefault(runway_idx, []), key)
+        self._entry[plane.uid] = (runway_idx, key)
+
+    def _unqueue(self, runway_idx: int, key: Tuple[float, Uid]):
+        q = self._queues[runway_idx]
+        del q[bisect_left(q, key)]
+        if not q:
+            del self._queues[runway_idx]
+
+
+SCHEDULERS = {"fifo": FifoScheduler, "eta": EtaScheduler}
+
+
+class LatencyHistogram:
+    """HDR-style histogram of non-negative integer values, e.g. durations in nanoseconds.
+
+    Values are bucketed by power of two, each split into `2**sub_bucket_bits`
+    linear sub-buckets, so recorded values keep a relative precision of about
+    `2**-sub_bucket_bits` over the whole 64-bit range in a fixed-size table.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 5):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub = 1 << sub_bucket_bits
+        self.counts = [0] * ((64 - sub_bucket_bits + 1) * self._sub)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int):
+        """Adds a single value."""
+        if value < 0:
+            value = 0
+        if value < 2 * self._sub:
+            idx = value
+        else:
+            shift = value.bit_length() - self.sub_bucket_bits - 1
+            idx = (shift + 1) * self._sub + (value >> shift) - self._sub
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _bucket_low(self, idx: int) -> int:
+        if idx < 2 * self._sub:
+            return idx
+        shift = idx // self._sub - 1
+        return (idx % self._sub + self._sub) << shift
+
+    def percentile(self, p: float) -> int:
+        """Returns lower bound of the bucket holding the `p`th percentile, for `p` in [0, 100]."""
+        if not self.count:
+            return 0
+        target = max(1, ceil(p / 100 * self.count))
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return max(self.min, min(self._bucket_low(idx), self.max))
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else None,
+            **{f"p{p:g}": self.percentile(p) for p in (50, 90, 99, 99.9)},
+        }
+
+
+class Metrics:
+    """Timers, histograms and gauges for monitoring the ATC control loop.
+
+    Durations are recorded in nanoseconds. Only every `frame_sample_every`th
+    received location frame has its age (time since the sim sent it) sampled.
+    """
+
+    def __init__(self, frame_sample_every: int = 10):
+        self.frame_sample_every = frame_sample_every
+        self.phases: Dict[str, LatencyHistogram] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {
+            "frame_age_ns": LatencyHistogram(),
+            "frames_per_step": LatencyHistogram(),
+        }
+        self.gauges: Dict[str, int] = {}
+        self._frames_seen = 0
+
+    def time_phase(self, name: str, phase: Callable[[], None]):
+        """Runs and times a phase of the control loop."""
+        start = time.perf_counter_ns()
+        phase()
+        elapsed = time.perf_counter_ns() - start
+        hist = self.phases.get(name)
+        if hist is None:
+            hist = self.phases[name] = LatencyHistogram()
+        hist.record(elapsed)
+
+    def record_frames(self, frames: List[LocFrame]):
+        """Records number and sampled age of location frames received in a step."""
+        now = time.perf_counter()
+        self.histograms["frames_per_step"].record(len(frames))
+        for frame in frames:
+            self._frames_seen += 1
+            if self._frames_seen % self.frame_sample_every == 0:
+                self.histograms["frame_age_ns"].record(int((now - frame.sent) * 1e9))
+
+    def gauge(self, name: str, value: int):
+        self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "phases_ns": {name: hist.snapshot() for name, hist in self.phases.items()},
+            "histograms": {name: hist.snapshot() for name, hist in self.histograms.items()},
+            "gauges": dict(self.gauges),
+        }
+
+    def to_json(self, **kwargs) -> str:
+        """Returns current snapshot serialized as JSON."""
+        return json.dumps(self.snapshot(), **kwargs)
+
+
+@dataclasses.dataclass(frozen=True)
+class HoldSlot:
+    """A holding orbit at a specific fix and altitude."""
+
+    fix: int
+    level: int
+    center: Loc
+    radius: float
+    altitude: float  # [m]
+
+
+class HoldingStack:
+    """Hands out holding slots, stacking aircraft vertically over each fix.
+
+    Orbits at different fixes must pass no closer than `lateral_sep`, so any
+    two allocated slots are separated either laterally or by altitude.
+    """
+
+    def __init__(
+        self, fixes: List[Loc], radius: float, levels: int, base_alt: float, level_sep: float,
+        lateral_sep: float = 0.0,
+    ):
+        for i, j in combinations(range(len(fixes)), 2):
+            if dist(fixes[i], fixes[j]) - 2 * radius < lateral_sep:
+                raise ValueError(f"Orbits at fixes {i} and {j} pass closer than {lateral_sep} m")
+        self.fixes = fixes
+        self.radius = radius
+        self.base_alt = base_alt
+        self.level_sep = level_sep
+        # Lowest free level first at each fix
+        self._free: List[List[int]] = [list(range(levels)) for _ in fixes]
+
+    def allocate(self, loc: Loc) -> Optional[HoldSlot]:
+        """Returns lowest free slot at the nearest fix with room, or `None` if all full."""
+        for fix in sorted(range(len(self.fixes)), key=lambda i: dist(loc, self.fixes[i])):
+            if self._free[fix]:
+                level = heapq.heappop(self._free[fix])
+                altitude = self.base_alt + level * self.level_sep
+                return HoldSlot(fix, level, self.fixes[fix], self.radius, altitude)
+        return None
+
+    def release(self, slot: HoldSlot):
+        """Frees a slot for reuse."""
+        heapq.heappush(self._free[slot.fix], slot.level)
+
 
 class ATCSystem:
     """System that tracks and commands aircraft."""
 
-    def __init__(self, comms: Comms):
+    def __init__(
+        self, comms: Comms, conflict_horizon: float = 30.0, scheduler: str = "eta",
+        metrics: Optional[Metrics] = None,
+    ):
         self.comms = comms
+        self.conflict_horizon = conflict_horizon  # [s]
+        self.metrics = metrics
+        self.t = 0.0  # Time of latest location update [s]
         self.planes: Dict[Uid, Aircraft] = {}
-        self._land_qs: List[Deque[Uid]] = [deque() for _ in ControlZone.RUNWAYS]
-        self._land_assigned: List[Optional[Uid]] = [None for _ in ControlZone.RUNWAYS]
+        self.conflicts: List[Conflict] = []
+        self._grid = SpatialGrid(3 * ControlZone.MIN_AIRCRAFT_SEP)
+        self._fix_t: Dict[Uid, float] = {}  # Time of each aircraft's latest location
+        self.runway_db = ControlZone.runway_db()
+        self.scheduler = SCHEDULERS[scheduler](self.runway_db)
+        self.holding = HoldingStack(
+            ControlZone.HOLD_FIXES, ControlZone.HOLD_RADIUS, ControlZone.HOLD_LEVELS,
+            ControlZone.HOLD_BASE_ALT, ControlZone.HOLD_LEVEL_SEP, 3 * ControlZone.MIN_AIRCRAFT_SEP,
+        )
+        self.hold_entry_radius = max(dist((0, 0), fix) for fix in ControlZone.HOLD_FIXES) + ControlZone.HOLD_RADIUS
+        self._holds: Dict[Uid, HoldSlot] = {}
+        self._hold_t: Dict[Uid, float] = {}  # Time each entered its hold [s]
+        self._unheld: Set[Uid] = set()  # Aircraft not landing or assigned a hold
+        # Held aircraft land on the runway nearest their fix, in order of hold entry
+        self._fix_runway = [self._find_closest_runway(fix) for fix in ControlZone.HOLD_FIXES]
+        self._hold_queues: Dict[int, Deque[Uid]] = {}
+        self._longest_hold = 0.0  # Longest hold of any aircraft that has left it [s]
+        # Aircraft cleared to land on each occupied runway, and the reverse
+        self._runway_lander: Dict[int, Uid] = {}
+        self._lander_runway: Dict[Uid, int] = {}
+        self._cleared_t: Dict[Uid, float] = {}  # Time each was cleared to land [s]
+        self.landing_interval = 20.0  # Moving average of time from landing clearance to touchdown [s]
+        self._phases = [
+            ("update_locations", self._update_locations),
+            ("potential_collision", self._handle_potential_collision),
+            ("conflict_probe", self._update_conflicts),
+            ("assign_holding", self._assign_holding),
+            ("runway_release", self._release_runways),
+        ]
 
     def mainloop(self):
         """Runs system by recieving location updates and sending commands."""
         while True:
-            self._update_locations()
-            self._handle_potential_collision()
-            self._assign_holding()
-
-            for runway_idx, uid in enumerate(self._land_assigned):
-                # Assign aircraft to land if free runway
-                if uid is None and self._land_qs[runway_idx]:
-                    next_land = self._land_qs[runway_idx].popleft()
-                    self._land_assigned[runway_idx] = next_land
-                    self.planes[next_land].state = AircraftState.LANDING
-                    self.comms.send_command(next_land, PlaneCommand.LAND, runway_idx)
+            self.step()
+
+    def step(self):
+        """Runs a single update of tracking and command decisions."""
+        if self.metrics is None:
+            for _, phase in self._phases:
+                phase()
+            return
+        for name, phase in self._phases:
+            self.metrics.time_phase(name, phase)
+        self.metrics.gauge("sim_to_atc_backlog", self.comms.frame_backlog())
+        self.metrics.gauge("atc_to_sim_backlog", self.comms.command_backlog())
+        self.metrics.gauge("dropped_commands", self.comms.dropped_commands)
+        self.metrics.gauge("dropped_locations", self.comms.dropped_locations)
+        self.metrics.gauge("tracked_aircraft", len(self.planes))
+
+    def _update_conflicts(self):
+        self.conflicts = self.probe_conflicts()
+
+    def longest_hold(self) -> float:
+        """Longest time any aircraft has spent holding so far, counting those still holding [s]."""
+        # Holds are entered in time order, so the first still holding has held longest
+        oldest = next(iter(self._hold_t.values()), self.t)
+        return max(self._longest_hold, self.t - oldest)
+
+    def _release_runways(self):
+        """Clears the next aircraft to land on each free runway, draining holds before those flying in."""
+        for runway_idx in sorted(self._hold_queues.keys() | set(self.scheduler.waiting_runways())):
+            # Assign aircraft to land if free runway
+            if runway_idx in self._runway_lander:
+                continue
+            held = self._hold_queues.get(runway_idx)
+            next_land = held[0] if held else self.scheduler.release(runway_idx, self.t)
+            if next_land is not None:
+                self._runway_lander[runway_idx] = next_land
+                self._lander_runway[next_land] = runway_idx
+                self._cleared_t[next_land] = self.t
+                plane = self.planes[next_land]
+                plane.state = AircraftState.LANDING
+                plane.runway = ControlZone.RUNWAYS[runway_idx]
+                self._unheld.discard(next_land)
+                self._release_hold(next_land)
+                self.comms.send_command(next_land, PlaneCommand.LAND, runway_idx)
 
     def _update_locations(self):
-        """Recieves and updates all aircraft locations."""
-        aircraft_locs = self.comms.get_plane_locs()
-        for uid, loc in aircraft_locs:
-            if uid in self.planes:
-                self.planes[uid].loc = loc
-            else:
-                # Track a new aircraft
-                self._new_aircraft(uid, loc)
-        if len(aircraft_locs) < len(self.planes):
+        """Recieves and applies all aircraft location changes."""
+        frames = self.comms.get_plane_updates()
+        if self.metrics is not None:
+            self.metrics.record_frames(frames)
+        for frame in frames:
+            self.t = frame.t
+            transit = set(frame.transit)
             # Remove any aircraft that have now landed
-            sent_uids = [x[0] for x in aircraft_locs]
-            to_remove = [uid for uid in self.planes.keys() if uid not in sent_uids]
-            for uid in to_remove:
-                self._remove_aircraft(uid)
+            if frame.keyframe:
+                for uid in self.planes.keys() - frame.present():
+                    self._remove_aircraft(uid)
+            for uid in frame.removed:
+                if uid in self.planes:
+                    self._remove_aircraft(uid)
+            for uid, loc in frame.spawned + frame.moved:
+                if uid in self.planes:
+                    self._track(self.planes[uid], loc, frame.t)
+                else:
+                    # Track a new aircraft
+                    self._new_aircraft(uid, loc, uid in transit)
+                self._fix_t[uid] = frame.t
+                self._grid.update(uid, loc)
+
+    def _track(self, plane: Aircraft, loc: Loc, t: float):
+        """Moves aircraft to a new location, estimating its velocity from the previous one."""
+        elapsed = t - self._fix_t[plane.uid]
+        if elapsed > 0:
+            dx, dy = loc[0] - plane.loc[0], loc[1] - plane.loc[1]
+            plane.heading = atan2(dy, dx)
+            plane.speed = hypot(dx, dy) / elapsed
+        plane.loc = loc
+        runway_idx = self.scheduler.update(plane, t)
+        if runway_idx is not None:
+            plane.runway = ControlZone.RUNWAYS[runway_idx]
 
     def _handle_potential_collision(self):
         """Checks for imminent proximity danger and attempt to correct."""
-        for plane in self.planes.values():
-            for other in self.planes.values():
-                if plane is other:
-                    continue
-                if dist(plane.loc, other.loc) <= 3 * ControlZone.MIN_AIRCRAFT_SEP:
-                    print("POTENTIAL COLLISION:",  plane, other)
-                    # TODO: Adjust headings to handle proximity
+        for uid, other in self._grid.close_pairs(3 * ControlZone.MIN_AIRCRAFT_SEP):
+            if self._vertically_separated(uid, other):
+                continue
+            print("POTENTIAL COLLISION:", self.planes[uid], self.planes[other])
+            # TODO: Adjust headings to handle proximity
+
+    def _vertically_separated(self, uid: Uid, other: Uid) -> bool:
+        """Whether two aircraft are assigned different holding altitudes."""
+        a, b = self._holds.get(uid), self._holds.get(other)
+        return a is not None and b is not None and a.altitude != b.altitude
+
+    def probe_conflicts(self, horizon: Optional[float] = None) -> List[Conflict]:
+        """Predicts losses of `3 * MIN_AIRCRAFT_SEP` within `horizon` seconds, most urgent first.
+
+        Aircraft are assumed to hold their current heading and speed, or to be
+        stationary if not yet known. Candidate pairs are found by a swept box
+        filter before computing the exact closest point of approach.
+
+        >>> atc = ATCSystem(Comms())
+        >>> atc.planes = {1: Aircraft(1, (-1000, 0), 0.0), 2: Aircraft(2, (1000, 0), PI)}
+        >>> [(sorted((c.uid, c.other)), round(c.t_cpa, 2)) for c in atc.probe_conflicts()]
+        [([1, 2], 7.14)]
+        >>> atc._holds = {1: HoldSlot(0, 0, (0, 0), 1_000, 1_500)}
+        >>> len(atc.probe_conflicts())  # Only one is holding, so not separated
+        1
+        >>> atc._holds[2] = HoldSlot(1, 1, (0, 0), 1_000, 1_800)
+        >>> atc.probe_conflicts()
+        []
+        """
+        horizon = self.conflict_horizon if horizon is None else horizon
+        sep = 3 * ControlZone.MIN_AIRCRAFT_SEP
+        n = len(self.planes)
+        planes = self.planes.values()
+        uids = np.fromiter(self.planes.keys(), dtype=np.int64, count=n)
+        x = np.fromiter((p.loc[0] for p in planes), dtype=np.float64, count=n)
+        y = np.fromiter((p.loc[1] for p in planes), dtype=np.float64, count=n)
+        heading = np.fromiter((p.heading for p in planes), dtype=np.float64, count=n)
+        speed = np.fromiter((p.speed for p in planes), dtype=np.float64, count=n)
+        vx = np.nan_to_num(speed * np.cos(heading))
+        vy = np.nan_to_num(speed * np.sin(heading))
+        holds = self._holds
+        alt = np.fromiter(
+            (holds[uid].altitude if uid in holds else np.nan for uid in self.planes), dtype=np.float64, count=n,
+        )
+
+        found = []
+        for i, j in swept_box_pairs(x, y, vx, vy, horizon, sep):
+            dx, dy = x[j] - x[i], y[j] - y[i]
+            dvx, dvy = vx[j] - vx[i], vy[j] - vy[i]
+            dv2 = dvx * dvx + dvy * dvy
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(dv2 > 0, -(dx * dvx + dy * dvy) / dv2, 0.0)
+            t = np.clip(t, 0.0, horizon)
+            d = np.hypot(dx + t * dvx, dy + t * dvy)
+            # Aircraft at different holding altitudes are vertically separated,
+            # any not holding (NaN altitude) are not
+            separated = ~np.isnan(alt[i]) & ~np.isnan(alt[j]) & (alt[i] != alt[j])
+            hit = (d < sep) & ~separated
+            found.append((uids[i[hit]], uids[j[hit]], t[hit], d[hit]))
+        if not found:
+            return []
+        a, b, t, d = (np.concatenate(col) for col in zip(*found))
+        order = np.lexsort((d, t))
+        return [
+            Conflict(*row)
+            for row in zip(a[order].tolist(), b[order].tolist(), t[order].tolist(), d[order].tolist())
+        ]
 
     def _assign_holding(self):
-        """Intelligently assigns holding patterns to "free" aircraft."""
-        for plane in self.planes.values():
-            if plane is AircraftState.FLIGHT:
-                # TODO: Assign holding pattern location if needed
-                pass
+        """Assigns holding patterns to aircraft that would leave the terminal area before their turn to land.
 
-    def _new_aircraft(self, uid: Uid, loc: Loc):
+        Held aircraft land before any still flying in, so an aircraft's turn
+        comes after everyone holding for its runway and those sequenced ahead
+        of it. Held aircraft are taken out of the scheduler's sequence.
+        """
+        entering = [
+            uid for uid in self._unheld
+            if hypot(*self.planes[uid].loc) <= self.hold_entry_radius
+        ]
+        if not entering:
+            return
+        # Landings ahead of each aircraft
+        ahead = {}
+        for runway_idx, q in self.scheduler.queues().items():
+            first = (runway_idx in self._runway_lander) + len(self._hold_queues.get(runway_idx, ()))
+            ahead.update((uid, first + i) for i, uid in enumerate(q))
+        for uid in entering:
+            plane = self.planes[uid]
+            if ahead.get(uid, 0) * self.landing_interval <= self._time_to_exit(plane):
+                continue
+            slot = self.holding.allocate(plane.loc)
+            if slot is None:
+                return
+            self._holds[uid] = slot
+            self._hold_t[uid] = self.t
+            self._unheld.discard(uid)
+            self.scheduler.remove(uid)
+            runway_idx = self._fix_runway[slot.fix]
+            self._hold_queues.setdefault(runway_idx, deque()).append(uid)
+            plane.state = AircraftState.HOLD
+            plane.runway = ControlZone.RUNWAYS[runway_idx]
+            self.comms.send_command(uid, PlaneCommand.HOLDING, (*slot.center, slot.radius, slot.altitude))
+
+    def _time_to_exit(self, plane: Aircraft) -> float:
+        """Time until an aircraft on its current track flies out past `hold_entry_radius` [s]."""
+        x, y = plane.loc
+        ux, uy = cos(plane.heading), sin(plane.heading)
+        along = x * ux + y * uy
+        # Distance along track to where it crosses the circle, outbound
+        s = -along + sqrt(max(along * along - x * x - y * y + self.hold_entry_radius ** 2, 0.0))
+        return s / max(plane.speed, 1.0)
+
+    def _release_hold(self, uid: Uid):
+        slot = self._holds.pop(uid, None)
+        if slot is None:
+            return
+        self.holding.release(slot)
+        self._longest_hold = max(self._longest_hold, self.t - self._hold_t.pop(uid))
+        runway_idx = self._fix_runway[slot.fix]
+        q = self._hold_queues[runway_idx]
+        q.remove(uid)
+        if not q:
+            del self._hold_queues[runway_idx]
+
+    def _new_aircraft(self, uid: Uid, loc: Loc, transit: bool = False):
         """Sets up tracking of new aircraft and assign landing runway."""
-        plane = Aircraft(uid, loc, float("NaN"))
-        runway_idx = self._find_closest_runway(loc)
-        plane.runway = ControlZone.RUNWAYS[runway_idx]
+        plane = Aircraft(uid, loc, float("NaN"), transit=transit)
         self.planes[plane.uid] = plane
-        self._land_qs[runway_idx].append(plane.uid)
+        if transit:
+            # Only passing through, so just tracked for separation
+            return
+        runway_idx = self.scheduler.add(plane, self.t)
+        plane.runway = ControlZone.RUNWAYS[runway_idx]
+        self._unheld.add(uid)
 
     def _remove_aircraft(self, uid: Uid):
-        """Removes tracking of specific aircraft."""
-        self._land_assigned[self._land_assigned.index(uid)] = None
+        """Removes tracking of specific aircraft, after landing or leaving the airspace."""
+        runway_idx = self._lander_runway.pop(uid, None)
+        if runway_idx is not None:
+            del self._runway_lander[runway_idx]
+            elapsed = self.t - self._cleared_t.pop(uid)
+            self.landing_interval += 0.1 * (elapsed - self.landing_interval)
+        self.scheduler.remove(uid)
+        self._unheld.discard(uid)
+        self._release_hold(uid)
+        self._grid.remove(uid)
+        self._fix_t.pop(uid)
         self.planes.pop(uid)
 
     def _find_closest_runway(self, loc: Loc) -> int:
         """Returns index of physically closest runway."""
-        min_i, min_dist = -1, float("inf")
-        for i, runway in enumerate(ControlZone.RUNWAYS):
-            d = dist(loc, runway.pos)
-            if d < min_dist:
-                min_i, min_dist = i, d
-        return min_i
+        return self.runway_db.nearest(loc)
+
+
+class Fleet:
+    """Struct-of-arrays store of simulated aircraft state.
+
+    Each column holds `n` live entries in the order they were added, followed by
+    spare capacity. Removing aircraft compacts the columns to keep them dense.
+    Aircraft handed in from other zones keep their own uids, so entries are not
+    sorted by uid; use `index` to find one.
+    """
+
+    COLUMNS = {
+        "uid": np.int64,
+        "x": np.float64,
+        "y": np.float64,
+        "heading": np.float64,
+        "speed": np.float64,
+        "state": np.int8,
+        "runway": np.int16,  # Index into `runways`, or -1 if unassigned
+        "transit": np.bool_,
+        # Holding orbit of radius `hold_r` around (`hold_x`, `hold_y`), or 0 radius if none.
+        # While in `HOLD`, position is at angle `hold_phase` around it at time `hold_t0`.
+        "hold_x": np.float64,
+        "hold_y": np.float64,
+        "hold_r": np.float64,
+        "hold_phase": np.float64,
+        "hold_t0": np.float64,
+    }
+
+    def __init__(self, runways: List[Runway], capacity: int = 256):
+        self.runways = runways
+        self.n = 0
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+        self._index: Dict[Uid, int] = {}
+        self._rw_x = np.array([r.pos[0] for r in runways])
+        self._rw_y = np.array([r.pos[1] for r in runways])
+        self._rw_heading = np.array([r.heading for r in runways])
+        self._rw_length = np.array([r.length for r in runways])
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __contains__(self, uid: Uid) -> bool:
+        return uid in self._index
+
+    def index(self, uid: Uid) -> int:
+        """Returns column index of a specific aircraft."""
+        return self._index[uid]
+
+    def add(self, plane: Aircraft):
+        """Appends a new aircraft, growing the columns if needed."""
+        if self.n == len(self.uid):
+            self._grow(2 * len(self.uid))
+        i, self.n = self.n, self.n + 1
+        self.uid[i] = plane.uid
+        self.x[i], self.y[i] = plane.loc
+        self.heading[i] = plane.heading
+        self.speed[i] = plane.speed
+        self.state[i] = plane.state.value
+        self.runway[i] = -1 if plane.runway is None else self.runways.index(plane.runway)
+        self.transit[i] = plane.transit
+        self.hold_r[i] = 0.0
+        self._index[plane.uid] = i
+
+    def aircraft(self, i: int) -> Aircraft:
+        """Returns a detached `Aircraft` view of the entry at column index `i`."""
+        runway = self.runway[i]
+        return Aircraft(
+            int(self.uid[i]),
+            (float(self.x[i]), float(self.y[i])),
+            float(self.heading[i]),
+            float(self.speed[i]),
+            AircraftState(self.state[i]),
+            self.runways[runway] if runway >= 0 else None,
+            bool(self.transit[i]),
+        )
+
+    def xy(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns copies of all aircraft x and y positions."""
+        return self.x[:self.n].copy(), self.y[:self.n].copy()
+
+    def views(self) -> Dict[Uid, Aircraft]:
+        """Returns `Aircraft` views of all aircraft keyed by uid."""
+        return {int(self.uid[i]): self.aircraft(i) for i in range(self.n)}
+
+    def approach(self, idx: np.ndarray, runway: np.ndarray):
+        """Turns aircraft at column indices `idx` towards the start of their given runways."""
+        self.runway[idx] = runway
+        self.state[idx] = AircraftState.APPROACH.value
+        self.heading[idx] = np.arctan2(self._rw_y[runway] - self.y[idx], self._rw_x[runway] - self.x[idx])
+        self.hold_r[idx] = 0.0
+
+    def hold(self, idx: np.ndarray, cx: np.ndarray, cy: np.ndarray, r: np.ndarray):
+        """Sends aircraft at column indices `idx` straight towards holding orbits to enter them."""
+        self.hold_x[idx], self.hold_y[idx], self.hold_r[idx] = cx, cy, r
+        self.state[idx] = AircraftState.FLIGHT.value
+        self.heading[idx] = np.arctan2(cy - self.y[idx], cx - self.x[idx])
+
+    def step(self, dt: float, t: float) -> int:
+        """Advances all aircraft by a time-step ending at time `t`.
+
+        Holding aircraft are placed on their orbits in closed form rather than
+        integrated. Returns how many aircraft have landed and been dropped.
+        """
+        n = self.n
+        x, y, heading, speed = self.x[:n], self.y[:n], self.heading[:n], self.speed[:n]
+        state, runway = self.state[:n], self.runway[:n]
+        x += dt * speed * np.cos(heading)
+        y += dt * speed * np.sin(heading)
+
+        hold_x, hold_y, hold_r = self.hold_x[:n], self.hold_y[:n], self.hold_r[:n]
+        holding = np.flatnonzero(state == AircraftState.HOLD.value)
+        if holding.size:
+            # Counter-clockwise at constant speed, so angular rate is speed / radius
+            phase = self.hold_phase[holding] + (speed[holding] / hold_r[holding]) * (t - self.hold_t0[holding])
+            x[holding] = hold_x[holding] + hold_r[holding] * np.cos(phase)
+            y[holding] = hold_y[holding] + hold_r[holding] * np.sin(phase)
+            heading[holding] = phase + PI/2
+
+        entering = np.flatnonzero((state == AircraftState.FLIGHT.value) & (hold_r > 0))
+        if entering.size:
+            dx, dy = x[entering] - hold_x[entering], y[entering] - hold_y[entering]
+            reached = np.hypot(dx, dy) <= hold_r[entering]
+            captured = entering[reached]
+            self.hold_phase[captured] = np.arctan2(dy[reached], dx[reached])
+            self.hold_t0[captured] = t
+            heading[captured] = self.hold_phase[captured] + PI/2
+            state[captured] = AircraftState.HOLD.value
+
+        # Masks are taken up front so a plane captured this step isn't also checked for landing
+        approach = np.flatnonzero(state == AircraftState.APPROACH.value)
+        landing = np.flatnonzero(state == AircraftState.LANDING.value)
+
+        if approach.size:
+            rw = runway[approach]
+            d = np.hypot(x[approach] - self._rw_x[rw], y[approach] - self._rw_y[rw])
+            captured = approach[d < 2 * speed[approach] * dt]
+            heading[captured] = self._rw_heading[runway[captured]]
+            state[captured] = AircraftState.LANDING.value
+
+        if landing.size:
+            rw = runway[landing]
+            d = np.hypot(x[landing] - self._rw_x[rw], y[landing] - self._rw_y[rw])
+            landed = landing[d >= self._rw_length[rw]]
+            if landed.size:
+                keep = np.ones(n, dtype=bool)
+                keep[landed] = False
+                self.compact(keep)
+                return landed.size
+        return 0
+
+    def compact(self, keep: np.ndarray):
+        """Keeps only entries where `keep` is set, preserving their order."""
+        m = int(np.count_nonzero(keep))
+        for name in self.COLUMNS:
+            col = getattr(self, name)
+            col[:m] = col[:self.n][keep]
+        self.n = m
+        self._index = {uid: i for i, uid in enumerate(self.uid[:m].tolist())}
+
+    def _grow(self, capacity: int):
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+
+@dataclasses.dataclass(frozen=True)
+class CommandStats:
+    """Metrics of the ATC command batch applied in the latest sim step."""
+
+    batch: int = 0  # Commands applied
+    total: int = 0  # Commands applied over all steps
+    max_age: float = 0.0  # Oldest command's time since sent [s]
+    mean_age: float = 0.0  # [s]
 
 
 class Sim:
     """Track and simulate physical aircraft."""
 
-    def __init__(self, comms: Comms, spawn_prob: float = 0.98, dt: float = 0.1):
+    def __init__(
+        self, comms: Comms, spawn_prob: float = 0.98, dt: float = 0.1, seed: int = 3,
+        recorder: Optional["TrajectoryRecorder"] = None, uid_base: int = 0, publish_snapshot: bool = False,
+        transit_frac: float = 0.0,
+    ):
         self.comms = comms
+        self.uid_base = uid_base
         self.spawn_prob = spawn_prob
+        self.transit_frac = transit_frac  # Fraction of spawns only passing through the zone
         self.dt = dt
+        self.recorder = recorder
+        self.publish_snapshot = publish_snapshot  # Whether to keep `locs_snapshot` current, e.g. for a renderer
+        self.tick = 0
+        self.t = 0.0  # Simulated time [s]
         self.n = 0
-        self.planes: Dict[Uid, Aircraft] = {}
-        random.seed(3)
+        self.landed = 0
+        self.fleet = Fleet(ControlZone.RUNWAYS)
+        self.rng = random.Random(seed)
+        self.command_stats = CommandStats()
+        self.locs_snapshot: Tuple[np.ndarray, np.ndarray] = self.fleet.xy()
+        self._dispatch: Dict[PlaneCommand, Callable[[List[Command]], None]] = {
+            PlaneCommand.HEADING: self._apply_heading,
+            PlaneCommand.HOLDING: self._apply_holding,
+            PlaneCommand.LAND: self._apply_land,
+        }
+
+    @property
+    def planes(self) -> Dict[Uid, Aircraft]:
+        """Snapshot of all aircraft as `Aircraft` views."""
+        return self.fleet.views()
 
     def mainloop(self):
         """Simulates aircraft movement, sends location updates, and spawns aircraft."""
         while True:
-            tmp = self.comms.check_for_command()
-            if tmp:
-                uid, command, data = tmp
-                if command is PlaneCommand.HEADING:
-                    self.planes[uid].heading = data
-                elif command is PlaneCommand.HOLDING:
-                    # TODO: Implement simulation of circular flight
-                    raise RuntimeError("Haven't implemented this")
-                elif command is PlaneCommand.LAND:
-                    plane = self.planes[uid]
-                    plane.runway = ControlZone.RUNWAYS[data]
-                    plane.state = AircraftState.APPROACH
-                    dy, dx = plane.runway.pos[1] - plane.loc[1], plane.runway.pos[0] - plane.loc[0]
-                    plane.heading = atan2(dy, dx)
-
-            self._simulate_planes()
-
-            if random.random() > self.spawn_prob:
-                self.add_random_plane()
-
-            plane_locs = [(plane.uid, plane.loc) for plane in self.planes.values()]
-            self.comms.update_plane_locs(plane_locs)
+            self.step()
             time.sleep(self.dt)
 
+    def step(self):
+        """Advances simulation by a single time-step of `dt`."""
+        fleet = self.fleet
+        self._apply_commands(self.comms.drain_commands())
+        self._simulate_planes()
+
+        if self.rng.random() > self.spawn_prob:
+            self.add_random_plane()
+
+        self.tick += 1
+        self.t += self.dt
+        if self.recorder is not None:
+            self.recorder.append(self.tick, fleet)
+        n = fleet.n
+        self.comms.update_plane_locs(fleet.uid[:n], fleet.x[:n], fleet.y[:n], self.t, fleet.transit[:n])
+        if self.publish_snapshot:
+            # Swapped in whole, so other threads always see positions from a single step
+            self.locs_snapshot = fleet.xy()
+
+    def _apply_commands(self, cmds: List[Command]):
+        """Applies a batch of commands, dispatching consecutive runs of the same type together."""
+        now = time.perf_counter()
+        ages = [now - cmd.sent for cmd in cmds]
+        self.command_stats = CommandStats(
+            len(cmds), self.command_stats.total + len(cmds),
+            max(ages, default=0.0), sum(ages) / len(ages) if ages else 0.0,
+        )
+        for command, run in groupby(cmds, key=lambda cmd: cmd.command):
+            # Skip aircraft that have landed or left since the command was sent
+            run = [cmd for cmd in run if cmd.uid in self.fleet]
+            if run:
+                self._dispatch[command](run)
+
+    def _apply_heading(self, cmds: List[Command]):
+        idx = [self.fleet.index(cmd.uid) for cmd in cmds]
+        self.fleet.heading[idx] = [cmd.data for cmd in cmds]
+
+    def _apply_holding(self, cmds: List[Command]):
+        idx = np.array([self.fleet.index(cmd.uid) for cmd in cmds])
+        cx, cy, r = np.array([cmd.data[:3] for cmd in cmds]).T
+        self.fleet.hold(idx, cx, cy, r)
+
+    def _apply_land(self, cmds: List[Command]):
+        idx = np.array([self.fleet.index(cmd.uid) for cmd in cmds])
+        self.fleet.approach(idx, np.array([cmd.data for cmd in cmds]))
+
     def add_random_plane(self):
         """Add a new random plane on the perimeter."""
-        plane = self._gen_random_plane()
-        self.planes[plane.uid] = plane
+        self.fleet.add(self._gen_random_plane())
 
     def _simulate_planes(self):
         """Simulates a time-step for aircraft."""
-        to_remove = []
-        for uid, plane in self.planes.items():
-            x, y = plane.loc
-            vx, vy = plane.speed * cos(plane.heading), plane.speed * sin(plane.heading)
-            plane.loc = (x + self.dt * vx, y + self.dt * vy)
-
-            if plane.state is AircraftState.APPROACH:
-                if dist(plane.loc, plane.runway.pos) < (2 * plane.speed * self.dt):
-                    plane.heading = plane.runway.heading
-                    plane.state = AircraftState.LANDING
-            elif plane.state is AircraftState.LANDING:
-                if dist(plane.loc, plane.runway.pos) >= plane.runway.length:
-                    to_remove.append(uid)
-        for uid in to_remove:
-            self.planes.pop(uid)
+        self.landed += self.fleet.step(self.dt, self.t + self.dt)
 
     def _gen_random_plane(self):
         """Generates random plane on airspace perimeter."""
         n, self.n = self.n, self.n + 1
-        angle = 2 * PI * random.random()
+        angle = 2 * PI * self.rng.random()
         x = ControlZone.AIRSPACE_RADIUS * cos(angle)
         y = ControlZone.AIRSPACE_RADIUS * sin(angle)
-        return Aircraft(n, (x, y), angle - PI)
+        if self.transit_frac and self.rng.random() < self.transit_frac:
+            # Cross the zone on a track up to 45 degrees off the field, to fly on into a neighbour
+            heading = angle - PI + self.rng.uniform(-PI/4, PI/4)
+            return Aircraft(self.uid_base + n, (x, y), heading, transit=True)
+        return Aircraft(self.uid_base + n, (x, y), angle - PI)
+
+    def take_departures(self, half_width: float) -> List[Aircraft]:
+        """Removes and returns freely flying aircraft outside the square of `half_width` around the origin."""
+        fleet = self.fleet
+        n = fleet.n
+        out = np.flatnonzero(
+            (fleet.state[:n] == AircraftState.FLIGHT.value)
+            & ((np.abs(fleet.x[:n]) > half_width) | (np.abs(fleet.y[:n]) > half_width))
+        )
+        if not out.size:
+            return []
+        departures = [fleet.aircraft(i) for i in out.tolist()]
+        keep = np.ones(n, dtype=bool)
+        keep[out] = False
+        fleet.compact(keep)
+        return departures
+
+
+class TrajectoryRecorder:
+    """Records per-tick aircraft state to a directory of columnar `.npy` segments.
+
+    Rows of (tick, uid, x, y, heading, state, transit) are buffered per column and
+    flushed as one `<segment>.<column>.npy` file per column once `chunk_rows`
+    would be exceeded. Ticks are never split across segments. Each segment
+    also has a `<segment>.index.npy` of (tick, first row) for every tick, so
+    ticks without any aircraft are kept too.
+    """
+
+    COLUMNS = {
+        "tick": np.int64,
+        "uid": np.int64,
+        "x": np.float64,
+        "y": np.float64,
+        "heading": np.float64,
+        "state": np.int8,
+        "transit": np.bool_,
+    }
+
+    def __init__(self, path: str, dt: float, chunk_rows: int = 1 << 20):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.segments = 0
+        self._rows = 0
+        self._bufs = {name: np.empty(chunk_rows, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self._index: List[Tuple[int, int]] = []
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"dt": dt, "columns": list(self.COLUMNS)}, f)
+
+    def append(self, tick: int, fleet: Fleet):
+        """Buffers the state of every aircraft in a fleet at a tick."""
+        n = fleet.n
+        if self._rows + n > self.chunk_rows:
+            self.flush()
+        if n > len(self._bufs["tick"]):
+            self._bufs = {name: np.empty(n, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self._index.append((tick, self._rows))
+        rows = slice(self._rows, self._rows + n)
+        self._bufs["tick"][rows] = tick
+        for name in ("uid", "x", "y", "heading", "state", "transit"):
+            self._bufs[name][rows] = getattr(fleet, name)[:n]
+        self._rows += n
+
+    def flush(self):
+        """Writes buffered rows out as a new segment."""
+        if not self._index:
+            return
+        for name, buf in self._bufs.items():
+            np.save(os.path.join(self.path, f"{self.segments:06d}.{name}.npy"), buf[:self._rows])
+        index = np.array(self._index, dtype=np.int64).reshape(-1, 2)
+        np.save(os.path.join(self.path, f"{self.segments:06d}.index.npy"), index)
+        self.segments += 1
+        self._rows = 0
+        self._index = []
+
+    def close(self):
+        self.flush()
+
+
+class TrajectoryReplay:
+    """Memory-mapped reader of a recording made by `TrajectoryRecorder`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.dt = meta["dt"]
+        self.columns = meta["columns"]
+        count = len([name for name in os.listdir(path) if name.endswith(".tick.npy")])
+        self.segments = [
+            {name: np.load(os.path.join(path, f"{seg:06d}.{name}.npy"), mmap_mode="r") for name in self.columns}
+            for seg in range(count)
+        ]
+        self.indexes = [np.load(os.path.join(path, f"{seg:06d}.index.npy")) for seg in range(count)]
+
+    def frames(self) -> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+        """Yields (tick, uids, xs, ys, transit) for each recorded tick in order, including empty ones.
+
+        `transit` is `None` for recordings made before it was recorded.
+        """
+        for seg, index in zip(self.segments, self.indexes):
+            bounds = np.append(index[:, 1], len(seg["tick"]))
+            for tick, start, stop in zip(index[:, 0].tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+                transit = seg["transit"][start:stop] if "transit" in seg else None
+                yield tick, seg["uid"][start:stop], seg["x"][start:stop], seg["y"][start:stop], transit
 
+    def landings(self) -> int:
+        """Returns number of aircraft last recorded landing that are gone by the final tick."""
+        last_state: Dict[int, int] = {}
+        for seg in self.segments:
+            # Last row of each uid in the segment, later segments overriding earlier
+            uids, rev = np.unique(seg["uid"][::-1], return_index=True)
+            states = seg["state"][len(seg["uid"]) - 1 - rev]
+            last_state.update(zip(uids.tolist(), states.tolist()))
+        final = self.indexes[-1] if self.indexes else None
+        if final is not None and len(final):
+            seg = self.segments[-1]
+            for uid in seg["uid"][final[-1, 1]:].tolist():
+                last_state.pop(uid, None)
+        return sum(state == AircraftState.LANDING.value for state in last_state.values())
 
-def draw_loop(planes):
-    """Draws live plot of airspace and all aircraft. Requires `matplotlib`."""
-    zone = plt.Circle((0, 0), ControlZone.AIRSPACE_RADIUS, color="k", fill=False)
-    plt.gca().add_patch(zone)
-    for runway in ControlZone.RUNWAYS:
-        a, b = runway.get_line_points()
-        plt.plot([a[0], b[0]], [a[1], b[1]], "k")
-    plt.axis("equal")
-    plane_dots = plt.plot([], [], "+k")[0]
-    plt.show(block=False)
+    def slice_ticks(self, start: int, stop: int) -> Dict[str, np.ndarray]:
+        """Returns all columns for ticks in [start, stop), only reading the segments needed."""
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in self.columns}
+        for seg in self.segments:
+            ticks = seg["tick"]
+            if not len(ticks) or ticks[-1] < start or ticks[0] >= stop:
+                continue
+            lo, hi = np.searchsorted(ticks, [start, stop])
+            for name in self.columns:
+                parts[name].append(seg[name][lo:hi])
+        return {
+            name: np.concatenate(cols) if cols else np.empty(0, dtype=TrajectoryRecorder.COLUMNS[name])
+            for name, cols in parts.items()
+        }
 
-    while True:
-        xs = [plane.loc[0] for plane in planes.values()]
-        ys = [plane.loc[1] for plane in planes.values()]
-        plane_dots.set_xdata(xs)
-        plane_dots.set_ydata(ys)
-        plt.pause(0.05)
+    def feed(self, comms: Comms, speed: float = 1.0, on_frame: Optional[Callable[[], None]] = None) -> int:
+        """Sends every recorded frame through `comms` at `speed` times real-time, returning frame count.
+
+        With infinite `speed` frames are sent as fast as possible. `on_frame` is
+        called after each frame is sent, e.g. to step an `ATCSystem` in lockstep.
+        """
+        count = 0
+        start = time.perf_counter()
+        for tick, uids, xs, ys, transit in self.frames():
+            t = tick * self.dt
+            if speed != float("inf"):
+                time.sleep(max(0.0, t / speed - (time.perf_counter() - start)))
+            comms.update_plane_locs(uids, xs, ys, t, transit)
+            if on_frame is not None:
+                on_frame()
+            count += 1
+        return count
+
+
+@dataclasses.dataclass
+class HeadlessReport:
+    """Summary of a headless simulation run."""
+
+    ticks: int
+    sim_seconds: float
+    wall_seconds: float
+    peak_aircraft: int
+    landed: int
+    longest_hold: float = 0.0  # Longest any aircraft spent holding [s]
+
+    @property
+    def speedup(self) -> float:
+        """Simulated seconds per wall-clock second."""
+        return self.sim_seconds / self.wall_seconds if self.wall_seconds else float("inf")
+
+
+def run_headless(
+    duration: float, dt: float = 0.1, spawn_prob: float = 0.98, seed: int = 3, scheduler: str = "eta",
+    record: Optional[str] = None, metrics: Optional[Metrics] = None,
+) -> HeadlessReport:
+    """Steps `Sim` and `ATCSystem` in lockstep on one thread for `duration` simulated seconds.
+
+    Time only advances by `dt` per tick rather than with the wall clock, so runs
+    are deterministic for a given `seed` and go as fast as the CPU allows.
+    Trajectories are saved to the directory `record` if given.
+
+    Holds drain in order, so no aircraft is left holding for long:
+
+    >>> with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    ...     report = run_headless(600)
+    >>> report.longest_hold < 300
+    True
+    """
+    comms = Comms()
+    atc = ATCSystem(comms, scheduler=scheduler, metrics=metrics)
+    recorder = TrajectoryRecorder(record, dt) if record else None
+    sim = Sim(comms, spawn_prob=spawn_prob, dt=dt, seed=seed, recorder=recorder)
+
+    ticks = round(duration / dt)
+    peak = 0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        sim.step()
+        atc.step()
+        peak = max(peak, len(sim.fleet))
+    wall = time.perf_counter() - start
+    if recorder is not None:
+        recorder.close()
+    return HeadlessReport(ticks, sim.t, wall, peak, sim.landed, atc.longest_hold())
+
+
+def run_replay(path: str, speed: float = float("inf"), scheduler: str = "eta") -> HeadlessReport:
+    """Feeds recorded traffic to an `ATCSystem` stepped in lockstep with each frame.
+
+    Aircraft follow their recorded tracks, so commands from the ATC have no effect.
+    """
+    replay = TrajectoryReplay(path)
+    comms = Comms()
+    atc = ATCSystem(comms, scheduler=scheduler)
+    peak = 0
+
+    def on_frame():
+        nonlocal peak
+        atc.step()
+        comms.drain_commands()
+        peak = max(peak, len(atc.planes))
+
+    start = time.perf_counter()
+    ticks = replay.feed(comms, speed, on_frame)
+    wall = time.perf_counter() - start
+    return HeadlessReport(ticks, ticks * replay.dt, wall, peak, replay.landings(), atc.longest_hold())
+
+
+@dataclasses.dataclass
+class ShardReport:
+    """Summary of a sharded multi-zone simulation run."""
+
+    zones: int
+    workers: int
+    ticks: int
+    wall_seconds: float
+    aircraft_ticks: int  # Sum over ticks of aircraft simulated
+    landed: int
+    handoffs: int  # Aircraft received by the zone they flew into
+    exited: int  # Aircraft that flew out of the whole region
+    undelivered: int = 0  # Aircraft still in transit between zones when the run ended
+
+    @property
+    def aircraft_ticks_per_second(self) -> float:
+        return self.aircraft_ticks / self.wall_seconds if self.wall_seconds else float("inf")
+
+
+class ZoneGrid:
+    """Layout of `rows` x `cols` adjacent control zones, each a copy of `ControlZone`.
+
+    Zone `k` is centered at (2R * col, 2R * row) for R the airspace radius, and
+    owns the square of side 2R around its center. Each zone simulates in its own
+    local frame, with its center at the origin.
+    """
+
+    def __init__(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.half_width = ControlZone.AIRSPACE_RADIUS
+
+    def __len__(self) -> int:
+        return self.rows * self.cols
+
+    def center(self, zone: int) -> Loc:
+        row, col = divmod(zone, self.cols)
+        return (2 * self.half_width * col, 2 * self.half_width * row)
+
+    def owner(self, loc: Loc) -> Optional[int]:
+        """Returns zone owning a global position, or `None` if outside the region."""
+        col = round(loc[0] / (2 * self.half_width))
+        row = round(loc[1] / (2 * self.half_width))
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row * self.cols + col
+        return None
+
+
+def _shard_worker(
+    grid: ZoneGrid, zones: List[int], ticks: int, dt: float, spawn_prob: float, transit_frac: float,
+    inboxes: List[Any], barrier: Any, sync_every: int, sync_timeout: float, results: Any,
+):
+    """Runs a Sim and ATC pair per zone in lockstep, handing off aircraft between zones.
+
+    If this worker fails it breaks the barrier, so the others stop waiting for it.
+    """
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            pairs = {}
+            for zone in zones:
+                comms = Comms()
+                # Keep uids globally unique by giving each zone its own range
+                sim = Sim(
+                    comms, spawn_prob=spawn_prob, dt=dt, seed=zone, uid_base=zone << 40, transit_frac=transit_frac,
+                )
+                pairs[zone] = (sim, ATCSystem(comms))
+            # Handoffs waiting for room in the receiving zone's inbox
+            pending: Dict[int, List[Tuple[Uid, float, float, float, float, bool]]] = {}
+            aircraft_ticks = sent = handoffs = exited = 0
+
+            for tick in range(ticks):
+                outgoing: Dict[int, List[Tuple[Uid, float, float, float, float, bool]]] = pending
+                pending = {}
+                for zone, (sim, atc) in pairs.items():
+                    cx, cy = grid.center(zone)
+                    while True:
+                        try:
+                            batch = inboxes[zone].get_nowait()
+                        except queue.Empty:
+                            break
+                        for uid, gx, gy, heading, speed, transit in batch:
+                            sim.fleet.add(Aircraft(uid, (gx - cx, gy - cy), heading, speed, transit=transit))
+                        handoffs += len(batch)
+                    sim.step()
+                    atc.step()
+                    aircraft_ticks += len(sim.fleet)
+                    for plane in sim.take_departures(grid.half_width):
+                        gx, gy = plane.loc[0] + cx, plane.loc[1] + cy
+                        target = grid.owner((gx, gy))
+                        if target is None:
+                            exited += 1
+                        else:
+                            outgoing.setdefault(target, []).append(
+                                (plane.uid, gx, gy, plane.heading, plane.speed, plane.transit),
+                            )
+                for target, batch in outgoing.items():
+                    try:
+                        inboxes[target].put_nowait(batch)
+                        sent += len(batch)
+                    except queue.Full:
+                        pending[target] = batch
+                if (tick + 1) % sync_every == 0:
+                    barrier.wait(sync_timeout)
+
+            # Batches left in inboxes are counted as undelivered, so don't wait to flush them on exit
+            for inbox in inboxes:
+                inbox.cancel_join_thread()
+            landed = sum(sim.landed for sim, _ in pairs.values())
+            stranded = sum(len(batch) for batch in pending.values())
+            results.put((aircraft_ticks, landed, handoffs, exited, sent, stranded))
+    except BaseException:
+        barrier.abort()
+        raise
+
+
+def run_sharded(
+    rows: int, cols: int, workers: int, duration: float, dt: float = 0.1, spawn_prob: float = 0.98,
+    transit_frac: float = 0.25, exchange_capacity: int = 64, sync_every: int = 10, sync_timeout: float = 60.0,
+) -> ShardReport:
+    """Simulates a `rows` x `cols` grid of control zones across `workers` processes.
+
+    Zones are dealt round-robin to workers, which each step their own zones in
+    lockstep on a virtual clock, like `run_headless`. A `transit_frac` of spawns
+    only pass through their zone, and aircraft leaving a zone are handed to
+    the zone they fly into through its bounded inbox. When an
+    inbox is full they wait in transit until it has room. Workers sync every
+    `sync_every` ticks so no shard runs far ahead of its neighbours.
+
+    Raises `RuntimeError` if any worker fails, or waits over `sync_timeout`
+    seconds for the others to sync, after stopping all workers.
+    """
+    grid = ZoneGrid(rows, cols)
+    workers = min(workers, len(grid))
+    inboxes = [mp.Queue(exchange_capacity) for _ in range(len(grid))]
+    barrier = mp.Barrier(workers)
+    results = mp.Queue()
+    ticks = round(duration / dt)
+    procs = [
+        mp.Process(
+            target=_shard_worker,
+            args=(
+                grid, list(range(w, len(grid), workers)), ticks, dt, spawn_prob, transit_frac,
+                inboxes, barrier, sync_every, sync_timeout, results,
+            ),
+        )
+        for w in range(workers)
+    ]
+
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    totals = []
+    try:
+        while len(totals) < len(procs):
+            try:
+                totals.append(results.get(timeout=0.5))
+                continue
+            except queue.Empty:
+                pass
+            failed = [(w, proc.exitcode) for w, proc in enumerate(procs) if proc.exitcode not in (None, 0)]
+            if failed:
+                raise RuntimeError(f"Shard workers failed, as (worker, exit code): {failed}")
+            if all(proc.exitcode == 0 for proc in procs) and results.empty():
+                raise RuntimeError("Shard workers exited without reporting results")
+        wall = time.perf_counter() - start
+    finally:
+        for proc in procs:
+            if proc.is_alive() and len(totals) < len(procs):
+                proc.terminate()
+            proc.join()
+    aircraft_ticks, landed, handoffs, exited, sent, stranded = (sum(col) for col in zip(*totals))
+    return ShardReport(
+        len(grid), workers, ticks, wall, aircraft_ticks, landed, handoffs, exited, sent - handoffs + stranded,
+    )
+
+
+class Renderer:
+    """Live `matplotlib` plot of the airspace that only redraws aircraft each frame.
+
+    The static airspace and runways are rendered once and cached as a
+    background, which every frame restores before blitting the aircraft
+    markers over it. Above `max_markers` aircraft, positions are binned onto a
+    grid over the view with at most `max_markers` cells, and one marker is
+    drawn per occupied cell.
+    """
+
+    def __init__(
+        self, get_locs: Callable[[], Tuple[np.ndarray, np.ndarray]],
+        max_markers: int = 5000, interval: float = 0.05,
+    ):
+        self.get_locs = get_locs
+        self.max_markers = max_markers
+        self.bins = isqrt(max_markers)  # Grid cells per side, so never more cells than markers
+        self.interval = interval  # [s]
+        self._background = None
+
+    def run(self):
+        """Opens the plot and redraws it until the window is closed."""
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+        ax.add_patch(plt.Circle((0, 0), ControlZone.AIRSPACE_RADIUS, color="k", fill=False))
+        for runway in ControlZone.RUNWAYS:
+            a, b = runway.get_line_points()
+            ax.plot([a[0], b[0]], [a[1], b[1]], "k")
+        ax.axis("equal")
+        self.ax = ax
+        self.plane_dots = ax.plot([], [], "+k", animated=True)[0]
+        # Re-capture the background whenever the figure is fully redrawn, e.g. on resize
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
+        plt.show(block=False)
+        fig.canvas.draw()
+
+        while plt.fignum_exists(fig.number):
+            start = time.perf_counter()
+            self.draw_frame()
+            fig.canvas.flush_events()
+            time.sleep(max(0.0, self.interval - (time.perf_counter() - start)))
+
+    def draw_frame(self):
+        """Blits current aircraft markers over the cached background."""
+        canvas = self.ax.figure.canvas
+        canvas.restore_region(self._background)
+        self.plane_dots.set_data(*self.decimate(*self.get_locs()))
+        self.ax.draw_artist(self.plane_dots)
+        canvas.blit(self.ax.bbox)
+
+    def decimate(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns marker positions, binned to occupied grid cells in view if too many to draw."""
+        if len(xs) <= self.max_markers:
+            return xs, ys
+        (x0, x1), (y0, y1) = self.ax.get_xlim(), self.ax.get_ylim()
+        ix = np.floor((xs - x0) * (self.bins / (x1 - x0))).astype(np.int64)
+        iy = np.floor((ys - y0) * (self.bins / (y1 - y0))).astype(np.int64)
+        visible = (ix >= 0) & (ix < self.bins) & (iy >= 0) & (iy < self.bins)
+        cells = np.flatnonzero(np.bincount(ix[visible] * self.bins + iy[visible], minlength=self.bins ** 2))
+        cx, cy = np.divmod(cells, self.bins)
+        return x0 + (cx + 0.5) * ((x1 - x0) / self.bins), y0 + (cy + 0.5) * ((y1 - y0) / self.bins)
+
+    def _on_draw(self, event):
+        canvas = self.ax.figure.canvas
+        self._background = canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.plane_dots)
+
+
+def draw_loop(get_locs: Callable[[], Tuple[np.ndarray, np.ndarray]]):
+    """Draws live plot of airspace and all aircraft. Requires `matplotlib`.
+
+    `get_locs` is polled for a consistent snapshot of (xs, ys) of all aircraft every frame.
+    """
+    Renderer(get_locs).run()
+
+
+def _run_sim(comms: SharedMemComms, seed: int):
+    Sim(comms, seed=seed).mainloop()
+
+
+def _run_atc(comms: SharedMemComms, scheduler: str):
+    ATCSystem(comms, scheduler=scheduler).mainloop()
+
+
+def run_multiprocess(seed: int = 3, scheduler: str = "eta"):
+    """Runs sim and ATC in their own processes, rendering from this one if `DRAW_SIM`."""
+    comms = SharedMemComms()
+    procs = [
+        mp.Process(target=_run_sim, args=(comms, seed), daemon=True),
+        mp.Process(target=_run_atc, args=(comms, scheduler), daemon=True),
+    ]
+    for proc in procs:
+        proc.start()
+    try:
+        if DRAW_SIM:
+            def get_locs():
+                snap = comms.snapshot()
+                return (snap[3], snap[4]) if snap else (np.empty(0), np.empty(0))
+            draw_loop(get_locs)
+        else:
+            for proc in procs:
+                proc.join()
+    finally:
+        for proc in procs:
+            proc.terminate()
+        comms.close()
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--headless", type=float, metavar="SECONDS",
+        help="run lockstep on a virtual clock for SECONDS of simulated time and report speed",
+    )
+    parser.add_argument("--record", metavar="DIR", help="with --headless, save trajectories to DIR")
+    parser.add_argument("--replay", metavar="DIR", help="feed the ATC recorded trajectories from DIR")
+    parser.add_argument(
+        "--replay-speed", type=float, default=float("inf"), help="replay speed relative to real-time",
+    )
+    parser.add_argument("--metrics", metavar="FILE", help="with --headless, write ATC loop metrics as JSON to FILE")
+    parser.add_argument(
+        "--zones", type=int, nargs=2, metavar=("ROWS", "COLS"),
+        help="with --headless, simulate a ROWS x COLS grid of control zones sharded across processes",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes for --zones")
+    parser.add_argument("--seed", type=int, default=3, help="random seed for aircraft spawns")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default="eta", help="runway sequencing policy")
+    parser.add_argument("--runways", metavar="FILE", help="load runways from a .csv or .json runway database")
+    parser.add_argument(
+        "--processes", action="store_true",
+        help="run sim, ATC and renderer in separate processes over shared memory",
+    )
+    args = parser.parse_args()
+
+    if args.runways:
+        ControlZone.load_runways(args.runways)
+
+    if args.headless is not None and args.zones:
+        report = run_sharded(*args.zones, args.workers, args.headless)
+        print(
+            f"Simulated {report.zones} zones for {report.ticks} ticks on {report.workers} workers"
+            f" in {report.wall_seconds:.2f} s: {report.aircraft_ticks_per_second:.0f} aircraft-ticks / s,"
+            f" {report.landed} landed, {report.handoffs} handed off, {report.exited} exited,"
+            f" {report.undelivered} undelivered"
+        )
+        return
+
+    if args.headless is not None or args.replay:
+        if args.replay:
+            report = run_replay(args.replay, args.replay_speed, args.scheduler)
+        else:
+            metrics = Metrics() if args.metrics else None
+            report = run_headless(
+                args.headless, seed=args.seed, scheduler=args.scheduler, record=args.record, metrics=metrics,
+            )
+            if metrics is not None:
+                with open(args.metrics, "w") as f:
+                    f.write(metrics.to_json(indent=2))
+        print(
+            f"Simulated {report.sim_seconds:.1f} s ({report.ticks} ticks) in {report.wall_seconds:.2f} s:"
+            f" {report.speedup:.1f} sim-s / wall-s, peak {report.peak_aircraft} aircraft,"
+            f" {report.landed} landed, longest hold {report.longest_hold:.0f} s"
+        )
+        return
+
+    if args.processes:
+        run_multiprocess(args.seed, args.scheduler)
+        return
+
     comms = Comms()
-    atc = ATCSystem(comms)
-    sim = Sim(comms)
+    atc = ATCSystem(comms, scheduler=args.scheduler)
+    sim = Sim(comms, seed=args.seed, publish_snapshot=DRAW_SIM)
 
     tatc = Thread(target=atc.mainloop)
     tsim = Thread(target=sim.mainloop)
     tatc.start()
     tsim.start()
     if DRAW_SIM:
-        draw_loop(sim.planes)
+        draw_loop(lambda: sim.locs_snapshot)
 
 
 if __name__ == "__main__":
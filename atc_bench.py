@@ -0,0 +1,126 @@
+"""Benchmarks for the ATC simulation in `atc.py`."""
+
+import argparse
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import statistics
+import time
+from threading import Thread
+from typing import List
+
+from atc import (
+    SCHEDULERS, Comms, HeadlessReport, PlaneCommand, SharedMemComms, ShardReport, run_headless, run_sharded,
+)
+
+
+def _receive_commands(comms, count: int) -> List[float]:
+    """Busy-polls for `count` commands, returning latency of each from its send timestamp."""
+    latencies = []
+    while len(latencies) < count:
+        now = time.perf_counter()
+        latencies.extend(now - cmd.sent for cmd in comms.drain_commands())
+    return latencies
+
+
+def _receive_commands_proc(comms: SharedMemComms, count: int, out: mp.Queue):
+    out.put(_receive_commands(comms, count))
+
+
+def bench_command_latency(transport: str, count: int = 5000, interval: float = 2e-4) -> List[float]:
+    """Measures ATC to sim command latency for the "queue" or "shm" transport.
+
+    The queue transport is consumed from a thread, the shared memory one from a
+    separate process, as each would be used. Latency is measured on the
+    receiving side from the send time every command carries.
+    """
+    if transport == "queue":
+        comms = Comms()
+        result: List[List[float]] = []
+        consumer = Thread(target=lambda: result.append(_receive_commands(comms, count)))
+    elif transport == "shm":
+        comms = SharedMemComms(max_planes=1, cmd_capacity=count)
+        out = mp.Queue()
+        consumer = mp.Process(target=_receive_commands_proc, args=(comms, count, out))
+    else:
+        raise ValueError(f"Unknown transport {transport!r}")
+
+    consumer.start()
+    for uid in range(count):
+        comms.send_command(uid, PlaneCommand.HEADING, 0.0)
+        # Pace sends so latency isn't dominated by the backlog
+        deadline = time.perf_counter() + interval
+        while time.perf_counter() < deadline:
+            pass
+    if transport == "queue":
+        consumer.join()
+        return result[0]
+    latencies = out.get()
+    consumer.join()
+    comms.close()
+    return latencies
+
+
+def bench_landings_per_hour(scheduler: str, hours: float = 1.0, spawn_prob: float = 0.95) -> HeadlessReport:
+    """Runs a headless scenario of heavy inbound traffic under a runway scheduling policy."""
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence proximity warnings
+        return run_headless(3600 * hours, spawn_prob=spawn_prob, scheduler=scheduler)
+
+
+def bench_sharded_scaling(
+    rows: int = 4, cols: int = 4, max_workers: int = os.cpu_count(), duration: float = 300.0,
+) -> List[ShardReport]:
+    """Runs the same sharded multi-zone scenario on 1 to `max_workers` worker processes."""
+    return [run_sharded(rows, cols, workers, duration, spawn_prob=0.95) for workers in range(1, max_workers + 1)]
+
+
+def _report(name: str, samples: List[float], unit: str = "us", scale: float = 1e6):
+    samples = sorted(samples)
+    pct = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))] * scale
+    print(
+        f"{name:>8}: mean {statistics.fmean(samples) * scale:8.1f} {unit}"
+        f" | p50 {pct(0.5):8.1f} | p99 {pct(0.99):8.1f} | max {samples[-1] * scale:8.1f}"
+    )
+
+
+BENCHMARKS = ("latency", "landings", "sharding")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", choices=BENCHMARKS, default=BENCHMARKS, help="which to run")
+    parser.add_argument("--count", type=int, default=5000, help="commands sent per transport")
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated hours per scheduling policy")
+    parser.add_argument("--zones", type=int, nargs=2, default=(4, 4), metavar=("ROWS", "COLS"), help="zone grid")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="maximum worker processes")
+    parser.add_argument("--seconds", type=float, default=300.0, help="simulated seconds per sharded run")
+    args = parser.parse_args()
+
+    if "latency" in args.benchmarks:
+        print("Command latency (ATC -> sim):")
+        for transport in ("queue", "shm"):
+            _report(transport, bench_command_latency(transport, args.count))
+
+    if "landings" in args.benchmarks:
+        print("Runway throughput:")
+        for scheduler in SCHEDULERS:
+            report = bench_landings_per_hour(scheduler, args.hours)
+            print(
+                f"{scheduler:>8}: {report.landed / (report.sim_seconds / 3600):7.1f} landings / hour"
+                f" | peak {report.peak_aircraft} aircraft | {report.wall_seconds:.1f} s wall"
+            )
+
+    if "sharding" in args.benchmarks:
+        print(f"Sharded scaling ({args.zones[0]} x {args.zones[1]} zones):")
+        reports = bench_sharded_scaling(*args.zones, args.workers, args.seconds)
+        for report in reports:
+            print(
+                f"{report.workers:>3} workers: {report.aircraft_ticks_per_second:10.0f} aircraft-ticks / s"
+                f" | x{report.aircraft_ticks_per_second / reports[0].aircraft_ticks_per_second:.2f}"
+                f" | {report.handoffs} handoffs"
+            )
+
+
+if __name__ == "__main__":
+    main()
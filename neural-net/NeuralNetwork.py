@@ -1,5 +1,9 @@
 from enum import auto, Enum, unique
 import pickle
+import queue
+import threading
+import time
+from typing import NamedTuple
 
 import numpy as np
 
@@ -10,56 +14,209 @@ class ActFuncs(Enum):
     TANH = auto()
     RELU = auto()
 
+    # Each generator returns the function and its derivative, plus in-place
+    # versions: the function writing to `out`, and one multiplying `delta` by
+    # the derivative found from the function's output `a` (overwriting it),
+    # so the function needn't be recomputed
+
     @staticmethod
     def _gen_sigmoid():
         sig = lambda x: 1 / (1.0 + np.exp(-x))
         def sig_deriv(x):
             k = 1 / (1.0 + np.exp(-x))
             return k * (1 - k)
-        return sig, sig_deriv
+        def sig_(x, out):
+            np.negative(x, out=out)
+            np.exp(out, out=out)
+            out += 1.0
+            np.reciprocal(out, out=out)
+        def sig_deriv_(a, delta):
+            delta *= a
+            np.subtract(1.0, a, out=a)
+            delta *= a
+        return sig, sig_deriv, sig_, sig_deriv_
 
     @staticmethod
     def _gen_tanh():
         tn_deriv = lambda x: 1.0 - np.tanh(x) ** 2
-        return np.tanh, tn_deriv
+        tn_ = lambda x, out: np.tanh(x, out=out)
+        def tn_deriv_(a, delta):
+            np.multiply(a, a, out=a)
+            np.subtract(1.0, a, out=a)
+            delta *= a
+        return np.tanh, tn_deriv, tn_, tn_deriv_
 
     @staticmethod
     def _gen_relu():
         rl = lambda x: x * (x > 0)
         rl_deriv = lambda x: 1.0 * (x > 0)
-        return rl, rl_deriv
+        rl_ = lambda x, out: np.maximum(x, 0.0, out=out)
+        def rl_deriv_(a, delta):
+            np.greater(a, 0.0, out=a)
+            delta *= a
+        return rl, rl_deriv, rl_, rl_deriv_
 
-    @staticmethod
-    def get_act_funcs(act):
+    @classmethod
+    def get_act_funcs(cls, act):
         return {
-            self.SIGMOID: self._gen_sigmoid,
-            self.TANH: self._gen_tanh,
-            self.RELU: self._gen_relu,
+            cls.SIGMOID: cls._gen_sigmoid,
+            cls.TANH: cls._gen_tanh,
+            cls.RELU: cls._gen_relu,
         }[act]()
 
 
+class EpochStats(NamedTuple):
+    epoch: int
+    cost: float  # Summed over the epoch's batches
+    samples: int
+    seconds: float
+    wait_seconds: float  # Spent waiting on the loader
+
+    @property
+    def samples_per_second(self):
+        return self.samples / self.seconds if self.seconds else float("inf")
+
+
+class BatchLoader:
+    # Mini-batches of (input, expected output) for `NeuralNetwork.train_batches`.
+    # The source can be in-memory arrays, paths to `.npy` files (memory mapped,
+    # so they need not fit in RAM), or a callable returning an iterable of
+    # batches for each epoch. The next batch is loaded on a background thread
+    # while the current one trains
+
+    def __init__(self, inputs, outputs=None, batch_size=32, shuffle=True, prefetch=2, seed=None):
+        if callable(inputs):
+            self.batches = inputs
+            self.inputs = self.outputs = None
+        else:
+            self.batches = None
+            self.inputs = np.load(inputs, mmap_mode="r") if isinstance(inputs, str) else inputs
+            self.outputs = np.load(outputs, mmap_mode="r") if isinstance(outputs, str) else outputs
+            if len(self.inputs) != len(self.outputs):
+                raise ValueError("Inputs and outputs have different numbers of samples")
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        if self.inputs is None:
+            raise TypeError("Batch count of a generator source is unknown")
+        return -(-len(self.inputs) // self.batch_size)
+
+    def _index_batches(self):
+        n, bs = len(self.inputs), self.batch_size
+        if not self.shuffle:
+            return (slice(i, i + bs) for i in range(0, n, bs))
+        if isinstance(self.inputs, np.memmap):
+            # Random reads from disk are slow, so shuffle the order of contiguous
+            # batches and only the samples within each
+            starts = self.rng.permutation(range(0, n, bs))
+            return (i + self.rng.permutation(min(bs, n - i)) for i in starts)
+        order = self.rng.permutation(n)
+        return (order[i:i + bs] for i in range(0, n, bs))
+
+    def _epoch(self):
+        if self.batches is not None:
+            yield from self.batches()
+            return
+        for idx in self._index_batches():
+            yield np.asarray(self.inputs[idx]), np.asarray(self.outputs[idx])
+
+    def __iter__(self):
+        q = queue.Queue(maxsize=self.prefetch)
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for batch in self._epoch():
+                    if stop.is_set():
+                        return
+                    q.put(batch)
+                q.put(done)
+            except BaseException as e:
+                q.put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = q.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Unblock the producer if iteration stopped early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    thread.join(0.01)
+
+
 class NeuralNetwork:
 
-    def __init__(self, input_size, output_size, hidden_layers, act=ActFuncs.SIGMOID):
+    def __init__(self, input_size, output_size, hidden_layers, act=ActFuncs.SIGMOID, dtype=np.float64):
         self.num_layers = len(hidden_layers) + 2
         self.layer_sizes = [input_size] + hidden_layers + [output_size]
         self.act = act
-        self.f_act, self.f_act_diff = ActFuncs.get_act_funcs(self.act)
-        self.weights = [
-            np.random.randn(i, j)
-            for i, j in
-            zip(self.layer_sizes, self.layer_sizes[1:])
-        ]
+        self.f_act, self.f_act_diff, self.f_act_, self.f_act_diff_ = ActFuncs.get_act_funcs(self.act)
+        self.num_params = sum(i * j for i, j in zip(self.layer_sizes, self.layer_sizes[1:]))
+        # All weights live in one contiguous vector, `weights` are views into it
+        self.set_flat_params(np.random.randn(self.num_params).astype(dtype, copy=False))
+
+    def layer_views(self, flat):
+        # Splits a parameter vector, or the last axis of a stack of them, into weight matrices
+        views, start = [], 0
+        for i, j in zip(self.layer_sizes, self.layer_sizes[1:]):
+            views.append(flat[..., start:start + i * j].reshape(flat.shape[:-1] + (i, j)))
+            start += i * j
+        return views
+
+    def get_flat_params(self):
+        # The parameter vector itself, so changes to it change the network
+        return self.params
+
+    def set_flat_params(self, params):
+        # Adopts params as the parameter vector without copying, unless it needs
+        # converting to a contiguous vector of the network's dtype
+        dtype = getattr(self, "params", params).dtype
+        params = np.ascontiguousarray(params, dtype)
+        if params.shape != (self.num_params,):
+            raise ValueError(f"Expected {self.num_params} parameters, got shape {params.shape}")
+        self.params = params
+        self.weights = self.layer_views(params)
 
     def __str__(self):
-        print("+--------- Neural Net Info -----------+")
-        print("+ Layer Sizes:", self.layer_sizes)
-        print("+ Activation Func:", self.act)
-        print(
-            "+ Total Layer Count:", self.num_layers,
-            " |  Total Neuron Count:", sum(self.layer_sizes[1:]),
-        )
-        print("+-------------------------------------+")
+        return "\n".join([
+            "+--------- Neural Net Info -----------+",
+            f"+ Layer Sizes: {self.layer_sizes}",
+            f"+ Activation Func: {self.act}",
+            f"+ Total Layer Count: {self.num_layers}"
+            f"  |  Total Neuron Count: {sum(self.layer_sizes[1:])}",
+            "+-------------------------------------+",
+        ])
+
+    @property
+    def dtype(self):
+        return self.params.dtype
+
+    def __getstate__(self):
+        # Only the parameter vector is saved, activation functions and weight
+        # views are rebuilt on load, and workspaces on use
+        state = self.__dict__.copy()
+        for name in ("f_act", "f_act_diff", "f_act_", "f_act_diff_", "weights", "_workspaces"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.f_act, self.f_act_diff, self.f_act_, self.f_act_diff_ = ActFuncs.get_act_funcs(self.act)
+        self.weights = self.layer_views(self.params)
 
     def save(self, name):
         with open(name, "wb") as f:
@@ -70,7 +227,8 @@ class NeuralNetwork:
         with open(name, "rb") as f:
             return pickle.load(f)
 
-    def feed_forward(self, x)
+    def feed_forward(self, x):
+        x = np.asarray(x, self.dtype)
         for W in self.weights:
             z = np.dot(x, W)
             x = self.f_act(z)
@@ -80,72 +238,157 @@ class NeuralNetwork:
         output = self.feed_forward(x)
         return 0.5 * np.sum((expected_output - output) ** 2)
 
+    def _workspace(self, batch_size):
+        # Activation and error buffers of each layer's output for a batch size,
+        # plus a flat gradient buffer, allocated once and reused by every `backprop`
+        workspaces = self.__dict__.setdefault("_workspaces", {})
+        if batch_size not in workspaces:
+            grad = np.empty_like(self.params)
+            workspaces[batch_size] = (
+                [np.empty((batch_size, n), self.dtype) for n in self.layer_sizes[1:]],
+                [np.empty((batch_size, n), self.dtype) for n in self.layer_sizes[1:]],
+                grad,
+                self.layer_views(grad),
+            )
+        return workspaces[batch_size]
+
     def backprop(self, x, expected_output, learn_rate):
-        a = [x]
-
-
-        err = output - expected_output
-        for i in self.layer_sizes[1 : -1]:
-            delta = err * self.f_act_diff()
-
-    def backprop(self, trainingInput, trainingOutput, learn_rate):
-        output = self.feedForward(trainingInput)
-        err = output - trainingOutput
-        dJdW = []
-        for k in range(1, self.hiddenLayerCount + 1):
-            delta = err * self.activationFuncDeriv(self.z[-k])
-            dJdW.append(np.dot(self.a[-k - 1].T, delta))
-            err = np.dot(delta, self.synapseWeights[-k].T)
-        for k in range(1, self.hiddenLayerCount + 1):
-            self.synapseWeights[-k] -= learn_rate * dJdW[k - 1]
-        return self.costFunction(trainingInput, trainingOutput)
-
-    def train(
-        self, trainingInput, trainingOutput, learn_rate, iterations, callback=None
-    ):
-        costs = [self.costFunction(trainingInput, trainingOutput)]
+        # One gradient descent step, returning the cost before it
+        a, err, grad, dJdW = self._workspace(len(x))
+        prev = x
+        for W, out in zip(self.weights, a):
+            np.matmul(prev, W, out=out)
+            self.f_act_(out, out=out)
+            prev = out
+        np.subtract(a[-1], expected_output, out=err[-1])
+        cost = 0.5 * np.vdot(err[-1], err[-1])
+        for k in range(len(self.weights) - 1, -1, -1):
+            # Activations of layer k aren't needed again, so can be overwritten
+            delta = err[k]
+            self.f_act_diff_(a[k], delta)
+            np.matmul(x.T if k == 0 else a[k - 1].T, delta, out=dJdW[k])
+            if k:
+                np.matmul(delta, self.weights[k].T, out=err[k - 1])
+        grad *= learn_rate
+        self.params -= grad
+        return cost
+
+    def train(self, x, expected_output, learn_rate, iterations, callback=None):
+        costs = []
         for i in range(iterations):
-            cost = self.backprop(trainingInput, trainingOutput, learn_rate)
+            cost = self.backprop(x, expected_output, learn_rate)
             if callback:
                 callback(cost, self)
             costs.append(cost)
+        costs.append(self.cost_func(x, expected_output))
         return costs
 
+    def train_batches(self, loader, learn_rate, epochs=1, callback=None, report=print):
+        # Mini-batch gradient descent over a `BatchLoader`, or any iterable of
+        # (x, expected_output) batches, returning `EpochStats` per epoch
+        stats = []
+        for epoch in range(epochs):
+            cost, samples, wait = 0.0, 0, 0.0
+            start = time.perf_counter()
+            batches = iter(loader)
+            while True:
+                t = time.perf_counter()
+                batch = next(batches, None)
+                wait += time.perf_counter() - t
+                if batch is None:
+                    break
+                x, expected_output = batch
+                batch_cost = self.backprop(x, expected_output, learn_rate)
+                if callback:
+                    callback(batch_cost, self)
+                cost += batch_cost
+                samples += len(x)
+            stats.append(EpochStats(epoch, cost, samples, time.perf_counter() - start, wait))
+            if report:
+                s = stats[-1]
+                report(
+                    f"Epoch {epoch + 1}/{epochs}: cost {s.cost:.4g} | {s.seconds:.2f} s"
+                    f" | {s.samples_per_second:.0f} samples/s | {s.wait_seconds:.2f} s waiting on data"
+                )
+        return stats
+
 
-"""
 class GeneticNetworkPool:
+    # A population of networks shaped like `neural_network`, stored as rows of
+    # a (pool, params) genome matrix, with (pool, in, out) weight views of it
+    # so the whole population runs through each layer in one batched matmul.
+    # The evaluator either scores one network at a time (batched=False) or
+    # takes the pool and returns a (pool,) array of scores (batched=True)
 
-    def __init__(self, neural_network, gene_pool_size, evaluator):
+    def __init__(self, neural_network, gene_pool_size, evaluator, batched=False, seed=None):
         self.nn = neural_network
         self.pool_size = gene_pool_size
-        self.pool = []
         self.evaluator = evaluator
-        self.scores = []
+        self.batched = batched
+        self.rng = np.random.default_rng(seed)
+        self.scores = np.zeros(gene_pool_size)
+        self.generation = 0
 
         self.randomize_pool()
 
+    def _set_pool(self, pool):
+        self.pool = pool
+        self.layers = self.nn.layer_views(pool)
+
     def randomize_pool(self):
-        allLayers = np.concatenate(([self.nn.inputLayerSize], self.nn.hiddenLayersSizes, [self.nn.outputLayerSize]))
-        self.pool = []
-        for i in range(self.pool_size):
-            weights = []
-            for i in range(self.nn.hiddenLayerCount + 1):
-                weights.append(
-                    1 * np.random.randn(allLayers[i], allLayers[i + 1]) + 0
-                )
-            self.pool.append(weights)
+        self._set_pool(self.rng.standard_normal((self.pool_size, self.nn.num_params), dtype=self.nn.dtype))
 
     def evaluate_all(self):
-        self.scores = []
-        for gene in self.pool:
-            self.nn.synapseWeights = gene
-            self.scores.append(self.evaluator(self.nn))
+        if self.batched:
+            self.scores = np.asarray(self.evaluator(self), dtype=float)
+        else:
+            params = self.nn.get_flat_params()
+            for i, genome in enumerate(self.pool):
+                self.nn.set_flat_params(genome)
+                self.scores[i] = self.evaluator(self.nn)
+            self.nn.set_flat_params(params)
         return self.scores
 
-    def feed_forward_all(self, input_array):
-        outputs = []
-        for gene in self.pool:
-            self.nn.synapseWeights = gene
-            outputs.append(self.nn.feedForward(input_array))
-        return outputs
-"""
\ No newline at end of file
+    def feed_forward_all(self, x):
+        # x is (batch, in) shared by every genome, or (pool, batch, in)
+        x = np.asarray(x, self.nn.dtype)
+        for W in self.layers:
+            x = self.nn.f_act(np.matmul(x, W))
+        return x
+
+    def select(self, count, tournament=3):
+        # Tournament selection, returning indices of count winners
+        entrants = self.rng.integers(self.pool_size, size=(count, tournament))
+        return entrants[np.arange(count), np.argmax(self.scores[entrants], axis=1)]
+
+    def crossover(self, mothers, fathers):
+        # Uniform crossover, each parameter taken from either parent. The mask
+        # is unpacked from random bytes, far cheaper than a random float each
+        shape = (len(mothers), self.nn.num_params)
+        bits = np.frombuffer(self.rng.bytes(shape[0] * -(-shape[1] // 8)), np.uint8)
+        mask = np.unpackbits(bits.reshape(shape[0], -1), axis=1, count=shape[1]).view(bool)
+        return np.where(mask, self.pool[fathers], self.pool[mothers])
+
+    def mutate(self, genomes, rate=0.05, scale=0.5):
+        # Adds gaussian noise to about a `rate` fraction of parameters, in place,
+        # only drawing noise for those that are picked
+        flat = genomes.reshape(-1)
+        picked = self.rng.integers(flat.size, size=self.rng.binomial(flat.size, rate))
+        flat[picked] += scale * self.rng.standard_normal(len(picked), dtype=genomes.dtype)
+        return genomes
+
+    def next_generation(self, elite=0.05, tournament=3, mutation_rate=0.05, mutation_scale=0.5):
+        # Replaces the pool with its best `elite` fraction unchanged, and
+        # children of tournament selected parents. Uses the latest scores
+        n_elite = min(int(elite * self.pool_size), self.pool_size)
+        n_children = self.pool_size - n_elite
+        elites = np.argpartition(-self.scores, n_elite - 1)[:n_elite] if n_elite else np.empty(0, int)
+        pool = self.pool[elites]
+        if n_children:
+            parents = self.select(2 * n_children, tournament)
+            children = self.crossover(parents[:n_children], parents[n_children:])
+            self.mutate(children, mutation_rate, mutation_scale)
+            pool = np.concatenate((pool, children))
+        self._set_pool(pool)
+        self.generation += 1
+        return self.pool
@@ -1,31 +1,30 @@
 import numpy as np
 
-from pong import Pong, GUIPong
+from pong import VecPong
 from NeuralNetwork import NeuralNetwork, GeneticNetworkPool
 
+POOL_SIZE = 1000
 
-def make_move(game, nn):
-    ball_x, ball_y = game.get_ball_pos()
-    b = np.array((ball_x / game.width, ball_y / game.height))
-    raw_x = nn.feedForward(b)[0]
-    px = int(raw_x * game.width)
-    game.set_paddle_x(px)
 
-def evaluate(game, nn):
-    game.reset_score()
+def evaluate(game, pool):
+    # Plays one game per genome, all at once
+    game.reset()
+    size = np.array((game.width, game.height))
     for i in range(1000):
         game.update()
-        make_move(game, nn)
+        b = game.get_ball_pos() / size
+        raw_x = pool.feed_forward_all(b[:, np.newaxis, :])[:, 0, 0]
+        game.set_paddle_x(np.trunc(raw_x * game.width))
     return game.get_score()
 
 
-pong = Pong(500, 400)
-nn = NeuralNetwork(2, 1, [20, 20])
-pool = GeneticNetworkPool(nn, 10, lambda x: evaluate(pong, x))
+pong = VecPong(POOL_SIZE, 500, 400, seed=0)
+nn = NeuralNetwork(2, 1, [20, 20], dtype=np.float32)
+pool = GeneticNetworkPool(nn, POOL_SIZE, lambda x: evaluate(pong, x), batched=True, seed=0)
 
-nn.printInfo()
+print(nn)
 
 for i in range(10):
-    print(pool.evaluate_all())
-    pool.randomize_pool()
-
+    scores = pool.evaluate_all()
+    print(f"Generation {pool.generation}: best {scores.max():.0f} | mean {scores.mean():.1f}")
+    pool.next_generation()
@@ -2,6 +2,8 @@ import tkinter
 from math import sqrt
 from random import randrange
 
+import numpy as np
+
 
 class Pong:
 
@@ -85,6 +87,83 @@ class Pong:
         self.ball_pos = (x + vx, y + vy)
 
 
+class VecPong:
+    # N independent games of `Pong` stepped together, with the ball, paddle
+    # and score of each held in arrays and per-game branches done with masks
+
+    def __init__(
+        self,
+        n,
+        width,
+        height,
+        radius=None,
+        speed=None,
+        paddle_width=None,
+        seed=None,
+    ):
+        self.n = n
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+
+        self.score = np.zeros(n, dtype=int)
+
+        self.paddle_x = np.zeros(n)
+        self.paddle_height = 10
+        self.paddle_width = paddle_width if paddle_width else Pong.DEFAULT_PADDLE_WIDTH
+
+        self.ball_pos = np.zeros((n, 2))
+        self.ball_vel = np.zeros((n, 2))
+        self.ball_rad = radius if radius else Pong.DEFAULT_BALL_RADIUS
+        self.ball_speed = speed if speed else Pong.DEFAULT_BALL_SPEED
+        self.reset_ball()
+
+    def reset(self):
+        self.reset_score()
+        self.reset_ball()
+
+    def reset_score(self):
+        self.score[:] = 0
+
+    def reset_ball(self, mask=None):
+        # Resets every game's ball, or only those where mask is set
+        idx = np.arange(self.n) if mask is None else np.flatnonzero(mask)
+        self.ball_pos[idx] = (self.width // 2, self.height // 2)
+        # Set towards random direction upwards
+        vx = self.rng.integers(-self.ball_speed // 2, self.ball_speed // 2, size=len(idx))
+        vy = -np.abs(np.sqrt(self.ball_speed ** 2 - vx ** 2).astype(int))
+        self.ball_vel[idx, 0] = vx
+        self.ball_vel[idx, 1] = vy
+
+    def get_score(self):
+        return self.score
+
+    def get_ball_pos(self):
+        return self.ball_pos
+
+    def set_paddle_x(self, x):
+        np.clip(np.asarray(x) - self.paddle_width / 2, 0, self.width - self.paddle_width, out=self.paddle_x)
+
+    def update(self):
+        x, y = self.ball_pos.T
+        vx, vy = self.ball_vel.T
+        # Sides
+        vx[(x - self.ball_rad < 5) | (x + self.ball_rad > self.width - 5)] *= -1
+        # Roof
+        roof = y - self.ball_rad < 5
+        # Bottom
+        bottom = ~roof & (y + self.ball_rad > self.height - self.paddle_height)
+        # Paddle
+        hit = bottom & (self.paddle_x < x) & (x < self.paddle_x + self.paddle_width)
+        vy[roof | hit] *= -1
+        self.score += hit
+        # Lose
+        lost = bottom & ~hit
+        self.score -= lost
+        self.ball_pos[~lost] += self.ball_vel[~lost]
+        self.reset_ball(lost)
+
+
 class GUIPong(tkinter.Tk):
 
     def __init__(self, parent, width, height, callback=None, *args):
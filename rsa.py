@@ -1,17 +1,66 @@
-import random
+import argparse
 import base64
+import json
+import os
+import random
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import compress
+from math import gcd, isqrt, prod
+
+
+_sieve = bytearray()  # _sieve[i] is 1 if 2*i + 1 is prime
+
+
+def small_sieve(limit):
+    # Cached odd-only sieve covering at least [0, limit), regrown by doubling
+    global _sieve
+    if 2 * len(_sieve) < limit:
+        size = max(limit // 2 + 1, 2 * len(_sieve), 1024)
+        sieve = bytearray([1]) * size
+        sieve[0] = 0
+        for i in range(1, (isqrt(2*size) - 1) // 2 + 1):
+            if sieve[i]:
+                val = 2*i + 1
+                start = val*val // 2
+                sieve[start::val] = bytes(len(range(start, size, val)))
+        _sieve = sieve
+    return _sieve
+
+
+def iter_primes(stop=None, segment=1 << 16):
+    # Lazily yields primes below stop (or forever), sieving segment odd numbers at a time
+    if stop is None or stop > 2:
+        yield 2
+    base, base_limit = [], 1
+    lo = 1
+    while stop is None or lo < stop:
+        hi = lo + 2*segment if stop is None else min(lo + 2*segment, stop)
+        if isqrt(hi) > base_limit:
+            base_limit = 2 * isqrt(hi)
+            sieve = small_sieve(base_limit + 1)
+            base = [2*i + 1 for i in compress(range(base_limit // 2 + 1), sieve)]
+        size = (hi - lo + 1) // 2  # Odd numbers in [lo, hi)
+        seg = bytearray([1]) * size
+        for p in base:
+            if p*p >= hi:
+                break
+            start = max(p*p, -(-lo // p) * p)
+            if start % 2 == 0:
+                start += p
+            seg[(start-lo) // 2::p] = bytes(len(range((start-lo) // 2, size, p)))
+        if lo == 1:
+            seg[0] = 0
+        yield from (lo + 2*i for i in compress(range(size), seg))
+        lo += 2*segment
 
 
 def sieve_primes_to(n):
-    size = n // 2
-    sieve = [1] * size
-    limit = int(n**0.5)
-    for i in range(1, limit):
-        if sieve[i]:
-            val = 2*i + 1
-            tmp = ((size-1) - i) // val
-            sieve[i+val::val] = [0] * tmp
-    return [i*2 + 1 for i, v in enumerate(sieve) if v and i > 0]
+    # Odd primes below n
+    return [p for p in iter_primes(n) if p != 2]
 
 
 def euc_mod_inv(aa, bb):
@@ -24,91 +73,438 @@ def euc_mod_inv(aa, bb):
     return (lastx * (-1 if aa < 0 else 1)) % bb
 
 
-def calc_blocksize(n):
-    blocksize = 1
-    while 127**(blocksize+1) <= n:
-        blocksize += 1
+@lru_cache(maxsize=64)
+def calc_blocksize(n, radix=127):
+    blocksize, limit = 1, radix**2
+    while limit <= n:
+        blocksize, limit = blocksize + 1, limit * radix
     return blocksize
 
 
-def gen_tokens(p, q):
+# Key material must not be predictable, so use the OS's CSPRNG. Unlike the
+# Mersenne Twister, it also isn't duplicated into forked worker processes
+_sysrand = random.SystemRandom()
+
+
+def is_probable_prime(n, rounds=40):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        if n % p == 0:
+            return n == p
+    # Miller-Rabin, writing n - 1 = d * 2^s
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    for _ in range(rounds):
+        x = pow(_sysrand.randrange(2, n - 1), d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+_small_products = {}
+
+
+def small_primes_product(limit):
+    # Product of primes below limit, so trial division is a single gcd
+    if limit not in _small_products:
+        _small_products[limit] = prod(iter_primes(limit))
+    return _small_products[limit]
+
+
+def _prime_candidates(bits, e, rng):
+    product = small_primes_product(2000)
+    while True:
+        # Top two bits set so the product of two has exactly 2 * bits bits
+        c = rng.getrandbits(bits) | (3 << (bits - 2)) | 1
+        if gcd(c, product) == 1 and gcd(c - 1, e) == 1:
+            yield c
+
 
-    n = p * q
-    phi = (p-1) * (q-1)
+def random_prime(bits, e=65537, rounds=40, pool=None, workers=1, rng=None):
+    # Miller-Rabin tests up to 2 * workers candidates at once when given a process pool.
+    # Candidates come from rng, the system CSPRNG unless given e.g. a seeded random.Random
+    candidates = _prime_candidates(bits, e, rng or _sysrand)
+    if pool is None:
+        return next(c for c in candidates if is_probable_prime(c, rounds))
+    pending = deque()
+    while True:
+        while len(pending) < 2 * workers:
+            c = next(candidates)
+            pending.append((c, pool.submit(is_probable_prime, c, rounds)))
+        c, future = pending.popleft()
+        if future.result():
+            for _, future in pending:
+                future.cancel()
+            return c
+
+
+def generate_keypair(bits, primes=2, rounds=40, workers=None, rng=None):
+    # Same as gen_tokens but with fresh random primes for a bits-sized modulus
+    workers = workers or os.cpu_count()
+    sizes = [bits // primes + (i < bits % primes) for i in range(primes)]
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        found = []
+        while len(found) < primes:
+            r = random_prime(sizes[len(found)], rounds=rounds, pool=pool, workers=workers, rng=rng)
+            if r not in found:
+                found.append(r)
+            # With more than two primes the product can come up a bit short
+            if len(found) == primes and prod(found).bit_length() != bits:
+                found = []
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return gen_tokens(*found)
+
+
+class PrivateKey:
+    # Keeps the factors of n so decryption can work mod each prime separately
+    # (Chinese Remainder Theorem), which is ~3-4x faster than a single pow mod n.
+    # Keys with more than two primes follow the RFC 8017 multi-prime layout
+
+    def __init__(self, p, q, e, others=()):
+        self.p, self.q = p, q
+        self.primes = [p, q, *others]
+        self.n = prod(self.primes)
+        self.e = e
+        self.d = euc_mod_inv(e, prod(r-1 for r in self.primes))
+        self.dp = self.d % (p-1)
+        self.dq = self.d % (q-1)
+        self.qinv = euc_mod_inv(q, p)
+        # (r_i, d_i, t_i, R_i) per extra prime, where R_i is the product of the
+        # primes before r_i and t_i its inverse mod r_i
+        self.others = []
+        R = p * q
+        for r in others:
+            self.others.append((r, self.d % (r-1), euc_mod_inv(R, r), R))
+            R *= r
+
+    def decrypt(self, c):
+        m1 = pow(c, self.dp, self.p)
+        m2 = pow(c, self.dq, self.q)
+        h = self.qinv * (m1 - m2) % self.p
+        m = m2 + h * self.q
+        # Garner's recombination of the remaining primes
+        for r, d, t, R in self.others:
+            h = (pow(c, d, r) - m) * t % r
+            m += R * h
+        return m
+
+    def decrypt_plain(self, c):
+        return pow(c, self.d, self.n)
+
+
+def recover_factors(n, e, d):
+    # Factors a two-prime n given a matching key pair, since e*d - 1 is a multiple of the group order
+    k = d*e - 1
+    t = (k & -k).bit_length() - 1
+    for g in range(2, 102):
+        x = pow(g, k >> t, n)
+        for _ in range(t):
+            y = pow(x, 2, n)
+            if y == 1 and x not in (1, n-1):
+                p = gcd(x-1, n)
+                return (p, n // p) if is_probable_prime(p) and is_probable_prime(n // p) else None
+            x = y
+    return None
+
+
+@lru_cache(maxsize=32)
+def batch_key(d, n, e=65537):
+    # Per-key setup for rsa_decode_batch: a PrivateKey for CRT if n can be
+    # factored, otherwise just d. Kept for the most recently used keys
+    factors = recover_factors(n, e, d)
+    return d if factors is None else PrivateKey(*factors, e)
+
+
+def gen_tokens(p, q, *others):
+
+    n = prod([p, q, *others])
+    phi = prod([r-1 for r in (p, q, *others)])
 
     # print([x for x in sieve_primes_to(50) if phi % x != 0])
     # e = random.choice([x for x in sieve_primes_to(phi) if phi % x != 0])
     e = 65537
-    d = euc_mod_inv(e, phi)
+    key = PrivateKey(p, q, e, others)
+
+    return n, phi, e, key, calc_blocksize(n)
+
+
+_powers = {}
 
-    return n, phi, e, d, calc_blocksize(n)
 
+def radix_pow(radix, k):
+    # Block conversion splits at the same few exponents every block, so cache them
+    if (radix, k) not in _powers:
+        _powers[radix, k] = radix**k
+    return _powers[radix, k]
 
-def en_block(data, bsize):
-    blocks = [0] * -(-len(data) // bsize)
+
+def digits_to_int(digits, radix):
+    # Divide and conquer so big multiplies are balanced, Horner's for short runs
+    if len(digits) <= 32:
+        val = 0
+        for x in digits:
+            val = val*radix + x
+        return val
+    half = len(digits) // 2
+    return digits_to_int(digits[:half], radix) * radix_pow(radix, len(digits) - half) + digits_to_int(digits[half:], radix)
+
+
+def int_to_digits(val, size, radix, out):
+    # Appends the `size` lowest digits of val to out, most significant first
+    if size <= 32:
+        tmp = [0] * size
+        for k in range(size-1, -1, -1):
+            val, tmp[k] = divmod(val, radix)
+        out.extend(tmp)
+        return
+    half = size // 2
+    hi, lo = divmod(val, radix_pow(radix, size - half))
+    int_to_digits(hi, half, radix, out)
+    int_to_digits(lo, size - half, radix, out)
+
+
+def en_block(data, bsize, radix=127):
+    # radix=256 packs raw bytes, radix=127 is the original 7-bit digit format
+    blocks = []
     for i in range(0, len(data), bsize):
-        for k in range(bsize):
-            if i+k < len(data):
-                blocks[i // bsize] += data[i+k] * 127**(bsize-k-1)
+        chunk = data[i:i+bsize]
+        if radix == 256:
+            blocks.append(int.from_bytes(bytes(chunk).ljust(bsize, b'\0'), 'big'))
+        else:
+            blocks.append(digits_to_int(list(chunk) + [0] * (bsize - len(chunk)), radix))
     return blocks
 
 
-def de_block(blocks, bsize):
-    data = []
+def de_block(blocks, bsize, radix=127):
+    data = bytearray()
     for block in blocks:
-        tmp = [0] * (bsize)
-        for k in range(bsize):
-            block, tmp[bsize-k-1] = divmod(block, 127)
-        data.extend(tmp)
+        if radix == 256:
+            data += block.to_bytes(bsize, 'big')
+        else:
+            int_to_digits(block, bsize, radix, data)
     return data
 
 
-def rsa_encode(m, e, n):
-    blocksize = calc_blocksize(n)
-    blocks = en_block([ord(x) for x in m], blocksize)
+def rsa_encode(m, e, n, radix=127):
+    # radix=256 encrypts any UTF-8 text, radix=127 only ASCII
+    blocksize = calc_blocksize(n, radix)
+    data = m.encode() if radix == 256 else [ord(x) for x in m]
+    blocks = en_block(data, blocksize, radix)
     enc = [pow(i, e, n) for i in blocks]
-    bb = de_block(enc, blocksize+1)
+    bb = de_block(enc, blocksize+1, radix)
     c = base64.b64encode(bytes(bb)).decode()
     return c
 
 
-def rsa_decode(c, d, n):
-    blocksize = calc_blocksize(n)
-    bb = list(base64.b64decode(c))
-    blocks = en_block(bb, blocksize+1)
-    dec = [pow(i, d, n) for i in blocks]
-    asc = de_block(dec, blocksize)
+def rsa_decode(c, d, n, crt=True, radix=127):
+    # d is either the private exponent, or a PrivateKey to decrypt with CRT
+    blocksize = calc_blocksize(n, radix)
+    bb = base64.b64decode(c)
+    blocks = en_block(bb, blocksize+1, radix)
+    if isinstance(d, PrivateKey):
+        dec = [d.decrypt(i) if crt else d.decrypt_plain(i) for i in blocks]
+    else:
+        dec = [pow(i, d, n) for i in blocks]
+    asc = de_block(dec, blocksize, radix)
+    if radix == 256:
+        return bytes(asc).rstrip(b'\0').decode()
     z = ''.join([chr(i) for i in asc]).rstrip('\0')
     return z
 
 
+# Streams are a magic number followed by frames, each a header of plaintext
+# and ciphertext lengths then radix-256 ciphertext blocks of blocksize+1 bytes
+STREAM_MAGIC = b'RSA\x01'
+FRAME = struct.Struct('>II')
+
+
+def _decode_many(cs, d, n, crt, radix):
+    return [rsa_decode(c, d, n, crt, radix) for c in cs]
+
+
+def rsa_decode_batch(cs, d, n, crt=True, radix=127, e=65537, pool=None, workers=None, chunk=256):
+    # Decodes many messages under one key. d is either the private exponent,
+    # whose CRT key is cached by batch_key, or a PrivateKey. Batches of more
+    # than chunk messages are split over pool, or a new one of workers processes
+    if not isinstance(d, PrivateKey) and crt:
+        d = batch_key(d, n, e)
+    if len(cs) <= chunk or (pool is None and (workers or os.cpu_count()) <= 1):
+        return _decode_many(cs, d, n, crt, radix)
+    parts = [cs[i:i+chunk] for i in range(0, len(cs), chunk)]
+    decode = partial(_decode_many, d=d, n=n, crt=crt, radix=radix)
+    if pool is not None:
+        return [m for part in pool.map(decode, parts) for m in part]
+    with ProcessPoolExecutor(workers) as pool:
+        return [m for part in pool.map(decode, parts) for m in part]
+
+
+def _encrypt_chunk(chunk, e, n):
+    blocksize = calc_blocksize(n, 256)
+    enc = [pow(i, e, n) for i in en_block(chunk, blocksize, 256)]
+    return len(chunk), bytes(de_block(enc, blocksize+1, 256))
+
+
+def _decrypt_chunk(frame, d, n):
+    plain_len, data = frame
+    blocksize = calc_blocksize(n, 256)
+    blocks = en_block(data, blocksize+1, 256)
+    if isinstance(d, PrivateKey):
+        dec = [d.decrypt(i) for i in blocks]
+    else:
+        dec = [pow(i, d, n) for i in blocks]
+    return bytes(de_block(dec, blocksize, 256)[:plain_len])
+
+
+def _ordered_map(fn, items, workers):
+    # Like Executor.map, but only keeps a few chunks in flight instead of reading everything up front
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _read_frames(src):
+    while True:
+        header = src.read(FRAME.size)
+        if not header:
+            return
+        if len(header) < FRAME.size:
+            raise ValueError('Truncated frame header')
+        plain_len, size = FRAME.unpack(header)
+        data = src.read(size)
+        if len(data) < size:
+            raise ValueError('Truncated frame')
+        yield plain_len, data
+
+
+def encrypt_stream(src, dst, e, n, chunk_blocks=64, workers=None):
+    # src and dst are binary files, chunks of chunk_blocks blocks are encrypted in parallel
+    blocksize = calc_blocksize(n, 256)
+    chunks = iter(lambda: src.read(blocksize * chunk_blocks), b'')
+    dst.write(STREAM_MAGIC)
+    for plain_len, data in _ordered_map(partial(_encrypt_chunk, e=e, n=n), chunks, workers or os.cpu_count()):
+        dst.write(FRAME.pack(plain_len, len(data)))
+        dst.write(data)
+
+
+def decrypt_stream(src, dst, d, n, workers=None):
+    # d is either the private exponent, or a PrivateKey to decrypt with CRT
+    if src.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise ValueError('Not an encrypted stream')
+    for data in _ordered_map(partial(_decrypt_chunk, d=d, n=n), _read_frames(src), workers or os.cpu_count()):
+        dst.write(data)
+
+
 # p = 997
 # q = 991
-p = 499999996723
-q = 49999996589
-p = 13144131834269512219260941993714669605006625743172006030529504645527800951523697620149903055663251854220067020503783524785523675819158836547734770656069477
-q = 12288506286091804108262645407658709962803358186316309871205769703371233115856772658236824631092740403057127271928820363983819544292950195585905303695015971
+# p = 499999996723
+# q = 49999996589
+DEMO_P = 13144131834269512219260941993714669605006625743172006030529504645527800951523697620149903055663251854220067020503783524785523675819158836547734770656069477
+DEMO_Q = 12288506286091804108262645407658709962803358186316309871205769703371233115856772658236824631092740403057127271928820363983819544292950195585905303695015971
+
+
+def demo():
+    n, phi, e, key, blocksize = gen_tokens(DEMO_P, DEMO_Q)
+
+    print('MODULO    :', n)
+    print('TOTIENT   :', phi)
+    print('BLOCKSIZE :', blocksize)
+    print('PUBLIC    :', e)
+    print('PRIVATE   :', key.d)
+    print()
+
+    m = 'Conveying or northward offending admitting perfectly my. Colonel gravity get thought fat smiling add but. Wonder twenty hunted and put income set desire expect. Am cottage calling my is mistake cousins talking up.'
+
+    c = rsa_encode(m, e, n)
+
+    print('CLEARTEXT:', m)
+    print('ENCRYPTED:', c)
+
+    z = rsa_decode(c, key, n)
+    assert z == rsa_decode(c, key, n, crt=False) == rsa_decode(c, key.d, n)
+
+    print('DECRYPTED:', z)
+    assert rsa_decode(rsa_encode(m, e, n, radix=256), key, n, radix=256) == m
+
+    print('Ratio: ', int(len(c) / len(m) * 100), '%')
+    print()
+
+
+def save_key(path, key):
+    with open(path, 'w') as f:
+        fields = {'n': key.n, 'e': key.e, 'p': key.p, 'q': key.q}
+        if len(key.primes) > 2:
+            fields['others'] = key.primes[2:]
+        json.dump(fields, f, indent=2)
 
-n, phi, e, d, blocksize = gen_tokens(p, q)
 
-print('MODULO    :', n)
-print('TOTIENT   :', phi)
-print('BLOCKSIZE :', blocksize)
-print('PUBLIC    :', e)
-print('PRIVATE   :', d)
-print()
+def load_key(path):
+    # Returns n, e and a PrivateKey, which is None for public-only key files
+    with open(path) as f:
+        fields = json.load(f)
+    key = PrivateKey(fields['p'], fields['q'], fields['e'], fields.get('others', ())) if 'p' in fields else None
+    return fields['n'], fields['e'], key
 
 
-m = 'Conveying or northward offending admitting perfectly my. Colonel gravity get thought fat smiling add but. Wonder twenty hunted and put income set desire expect. Am cottage calling my is mistake cousins talking up.'
+def _open(path, mode):
+    if path == '-':
+        return open((sys.stdin if 'r' in mode else sys.stdout).fileno(), mode, closefd=False)
+    return open(path, mode)
 
-c = rsa_encode(m, e, n)
 
-print('CLEARTEXT:', m)
-print('ENCRYPTED:', c)
+def main():
+    parser = argparse.ArgumentParser(description='Toy RSA encryption')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('demo', help='encrypt and decrypt a sample message (default)')
+    keygen = commands.add_parser('keygen', help='generate a key file')
+    keygen.add_argument('output', help='JSON key file to write')
+    keygen.add_argument('--bits', type=int, default=2048, help='modulus size')
+    keygen.add_argument('--primes', type=int, default=2, help='number of prime factors')
+    keygen.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    for name in ('encrypt', 'decrypt'):
+        cmd = commands.add_parser(name, help=f'{name} a file')
+        cmd.add_argument('input', help="input file, or '-' for stdin")
+        cmd.add_argument('output', help="output file, or '-' for stdout")
+        cmd.add_argument('--key', help='JSON key file from keygen (default: the demo key)')
+        cmd.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    args = parser.parse_args()
 
-z = rsa_decode(c, d, n)
+    if args.command in (None, 'demo'):
+        demo()
+        return
+    if args.command == 'keygen':
+        save_key(args.output, generate_keypair(args.bits, args.primes, workers=args.workers)[3])
+        return
+    if args.key:
+        n, e, key = load_key(args.key)
+        if key is None and args.command == 'decrypt':
+            parser.error('decrypting needs a private key file')
+    else:
+        n, phi, e, key, blocksize = gen_tokens(DEMO_P, DEMO_Q)
+    with _open(args.input, 'rb') as src, _open(args.output, 'wb') as dst:
+        if args.command == 'encrypt':
+            encrypt_stream(src, dst, e, n, workers=args.workers)
+        else:
+            decrypt_stream(src, dst, key, n, workers=args.workers)
 
-print('DECRYPTED:', z)
 
-print('Ratio: ', int(len(c) / len(m) * 100), '%')
-print()
+if __name__ == '__main__':
+    main()
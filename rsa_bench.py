@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rsa import batch_key, generate_keypair, rsa_decode, rsa_decode_batch, rsa_encode
+
+
+# Seeded in main so benchmark keys are reproducible, real keys use the system CSPRNG
+KEY_RNG = random.Random()
+
+
+def make_key(bits, primes=2):
+    return generate_keypair(bits, primes, workers=1, rng=KEY_RNG)[3]
+
+
+def blocks_per_second(decrypt, blocks, min_time):
+    count, start = 0, time.perf_counter()
+    while True:
+        for c in blocks:
+            decrypt(c)
+        count += len(blocks)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return count / elapsed
+
+
+def bench_crt(sizes, min_time):
+    print(f'{"bits":>6} {"plain blk/s":>12} {"crt blk/s":>12} {"speedup":>8}')
+    for bits in sizes:
+        key = make_key(bits)
+        blocks = [random.randrange(key.n) for _ in range(16)]
+        assert all(key.decrypt(c) == key.decrypt_plain(c) for c in blocks)
+        plain = blocks_per_second(key.decrypt_plain, blocks, min_time)
+        crt = blocks_per_second(key.decrypt, blocks, min_time)
+        print(f'{bits:>6} {plain:>12.1f} {crt:>12.1f} {crt / plain:>7.2f}x')
+
+
+def bench_multiprime(sizes, min_time, counts=(2, 3, 4)):
+    print(f'{"bits":>6} {"primes":>6} {"crt blk/s":>12} {"vs 2":>8}')
+    for bits in sizes:
+        blocks = [random.randrange(1 << (bits - 1)) for _ in range(16)]
+        base = None
+        for primes in counts:
+            key = make_key(bits, primes)
+            assert all(key.decrypt(c) == key.decrypt_plain(c) for c in blocks)
+            rate = blocks_per_second(key.decrypt, blocks, min_time)
+            base = base or rate
+            print(f'{bits:>6} {primes:>6} {rate:>12.1f} {rate / base:>7.2f}x')
+
+
+def bench_batch(bits, sizes, loop_cap, workers):
+    # The rsa_decode loop is timed on at most loop_cap messages, as it's the slow one
+    key = make_key(bits)
+    messages = [f'message {i:06d}' for i in range(max(sizes))]
+    cs = [rsa_encode(m, key.e, key.n) for m in messages]
+    start = time.perf_counter()
+    batch_key(key.d, key.n, key.e)
+    print(f'{bits}-bit key setup: {(time.perf_counter() - start) * 1e3:.1f} ms, cached for later batches')
+    print(f'{"batch":>7} {"loop msg/s":>11} {"batch msg/s":>12} {"speedup":>8}')
+    with ProcessPoolExecutor(workers) as pool:
+        for size in sizes:
+            start = time.perf_counter()
+            for c in cs[:min(size, loop_cap)]:
+                rsa_decode(c, key.d, key.n)
+            loop = min(size, loop_cap) / (time.perf_counter() - start)
+            start = time.perf_counter()
+            assert rsa_decode_batch(cs[:size], key.d, key.n, pool=pool if workers > 1 else None) == messages[:size]
+            batch = size / (time.perf_counter() - start)
+            print(f'{size:>7} {loop:>11.1f} {batch:>12.1f} {batch / loop:>7.2f}x')
+
+
+BENCHMARKS = ('crt', 'multiprime', 'batch')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RSA decryption throughput')
+    parser.add_argument('benchmarks', nargs='*', choices=BENCHMARKS, default=BENCHMARKS, help='which to run')
+    parser.add_argument('--bits', type=int, nargs='+', help='modulus sizes (default: per benchmark)')
+    parser.add_argument('--time', type=float, default=1.0, help='minimum seconds per measurement')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for keys and blocks')
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000], help='messages per batch',
+    )
+    parser.add_argument('--loop-cap', type=int, default=1000, help='most messages to time rsa_decode on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes for batches')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    KEY_RNG.seed(args.seed)
+    if 'crt' in args.benchmarks:
+        bench_crt(args.bits or [512, 1024, 2048, 4096], args.time)
+    if 'multiprime' in args.benchmarks:
+        bench_multiprime(args.bits or [2048, 3072], args.time)
+    if 'batch' in args.benchmarks:
+        for bits in args.bits or [1024]:
+            bench_batch(bits, args.batch_sizes, args.loop_cap, args.workers)